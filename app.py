@@ -3,19 +3,627 @@ import yaml
 import sqlparse
 import re
 import os
+import sys
+import glob
+import codecs
+import logging
+import json
+import multiprocessing
+import sqlite3
+import hashlib
+import gzip
+import subprocess
+import tarfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from sqlparse import tokens as T
+from sqlparse import lexer as sql_lexer
+from sqlparse.engine.statement_splitter import StatementSplitter
 # Import jsonify for returning JSON responses, session for storing data
-from flask import Flask, render_template, request, flash, jsonify, session
+from flask import Flask, render_template, request, flash, jsonify, session, Response, stream_with_context, g, has_request_context, url_for
+import click
 
 # --- Flask App Setup ---
 app = Flask(__name__)
 # Required for session management and flashing messages
 app.secret_key = os.urandom(24) # Replace with a strong, persistent secret key in production
 
+# --- Logging ---
+# LOG_LEVEL gates output (per-token and per-file detail is DEBUG); LOG_FORMAT=json emits one JSON object per line
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats each record as a single-line JSON object."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+logger = logging.getLogger('sql_to_dbt')
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(_log_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
 # --- Constants ---
 MODELS_DIR = 'models'
 SCHEMA_FILE_NAMES = ['schema.yml', 'sources.yml']
+# Concurrency cap and retry policy for fetching repository files
+FETCH_MAX_WORKERS = int(os.environ.get('FETCH_MAX_WORKERS', 8))
+FETCH_MAX_RETRIES = int(os.environ.get('FETCH_MAX_RETRIES', 3))
+FETCH_BACKOFF_FACTOR = float(os.environ.get('FETCH_BACKOFF_FACTOR', 0.5))
+# How /load_model lists the repository: 'contents' (one call per directory),
+# 'tree' (one recursive git trees call) or 'tarball' (one archive download)
+INGEST_MODES = ('contents', 'tree', 'tarball')
+DEFAULT_INGEST_MODE = os.environ.get('INGEST_MODE', 'contents')
+# The compare API lists at most this many changed files; larger diffs need a full load
+GITHUB_COMPARE_MAX_FILES = 300
+# On-disk content cache for fetched files; set CONTENT_CACHE_DIR to '' to disable
+CONTENT_CACHE_DIR = os.environ.get('CONTENT_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sql-to-dbt'))
+CONTENT_CACHE_MAX_BYTES = int(os.environ.get('CONTENT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# Directory listings kept per repository manifest; the least recently used are dropped beyond this
+CONTENT_CACHE_MAX_LISTINGS = int(os.environ.get('CONTENT_CACHE_MAX_LISTINGS', 4096))
+# Worker processes for batch translation, and the batch size below which work stays in-process
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', os.cpu_count() or 1))
+BATCH_MIN_PARALLEL = int(os.environ.get('BATCH_MIN_PARALLEL', 8))
+# Start method for the batch and YAML process pools. Forking this threaded server can copy a lock
+# another thread holds (metrics, caches, logging) into the child, which then blocks on it forever
+PROCESS_POOL_CONTEXT = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+# Chunk size for reading streamed SQL input
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 64 * 1024))
+# Extract tables from the lexer's token stream, skipping sqlparse's grouping step, when that is provably equivalent
+FAST_EXTRACTOR = os.environ.get('FAST_EXTRACTOR', '1') not in ('0', 'false', 'no')
+# Memoized parse results for recently translated queries
+PARSE_CACHE_SIZE = int(os.environ.get('PARSE_CACHE_SIZE', 512))
+PARSE_CACHE_MAX_QUERY_CHARS = int(os.environ.get('PARSE_CACHE_MAX_QUERY_CHARS', 1024 * 1024))
+# Server-side store for loaded projects: 'memory' (per process) or 'sqlite' (shared by all workers)
+PROJECT_STORE_BACKEND = os.environ.get('PROJECT_STORE_BACKEND', 'memory')
+PROJECT_STORE_PATH = os.environ.get('PROJECT_STORE_PATH', os.path.join(CONTENT_CACHE_DIR or '.', 'projects.sqlite3'))
+PROJECT_STORE_MAX_IN_MEMORY = int(os.environ.get('PROJECT_STORE_MAX_IN_MEMORY', 16))
+# Commits the SQLite store keeps per repository; the least recently stored are dropped,
+# but never the repository's latest project
+PROJECT_STORE_MAX_PER_REPO = int(os.environ.get('PROJECT_STORE_MAX_PER_REPO', 8))
+# Local directories /load_model may read projects from (os.pathsep-separated); empty disables local loads
+LOCAL_PROJECT_ROOTS = [os.path.realpath(root) for root in os.environ.get('LOCAL_PROJECT_ROOTS', '').split(os.pathsep) if root]
+# Prebuilt project indexes (see the build-index command) loaded into the project store at startup
+PROJECT_INDEX_DIR = os.environ.get('PROJECT_INDEX_DIR', '')
+PROJECT_INDEX_SUFFIX = '.dbtindex.gz'
+PROJECT_INDEX_FORMAT = 'sql-to-dbt-project-index'
+PROJECT_INDEX_VERSION = 3
+# Entries per page returned by /tree, and the most a client may ask for
+TREE_PAGE_SIZE = int(os.environ.get('TREE_PAGE_SIZE', 200))
+TREE_MAX_PAGE_SIZE = 1000
+# Worker processes for parsing YAML files, and the total YAML size below which parsing stays in-process
+YAML_MAX_WORKERS = int(os.environ.get('YAML_MAX_WORKERS', os.cpu_count() or 1))
+YAML_PARALLEL_MIN_BYTES = int(os.environ.get('YAML_PARALLEL_MIN_BYTES', 2 * 1024 * 1024))
+# libyaml-backed loader when PyYAML was built with it; same results as SafeLoader, several times faster
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+# Files without a `sources:` key anywhere can't declare sources, so they are never parsed
+# (the key may follow a byte order mark at the very start of the file)
+YAML_SOURCES_KEY = re.compile(r"""(?:^\ufeff?|[{,])[ \t]*['"]?sources['"]?[ \t]*:""", re.MULTILINE)
+
+# Background project loads: concurrent jobs, how long finished jobs stay queryable,
+# and the minimum gap between progress events (plus the keep-alive interval) on the SSE stream
+LOAD_JOB_WORKERS = int(os.environ.get('LOAD_JOB_WORKERS', 2))
+LOAD_JOB_TTL = int(os.environ.get('LOAD_JOB_TTL', 600))
+LOAD_JOB_EVENT_INTERVAL = float(os.environ.get('LOAD_JOB_EVENT_INTERVAL', 0.25))
+LOAD_JOB_HEARTBEAT = 15
+# Jobs publish their progress to the project store at most this often (plus every heartbeat),
+# and a queued or running job not heard from in LOAD_JOB_STALE_AFTER died with its worker
+LOAD_JOB_PUBLISH_INTERVAL = float(os.environ.get('LOAD_JOB_PUBLISH_INTERVAL', 1.0))
+LOAD_JOB_STALE_AFTER = 4 * LOAD_JOB_HEARTBEAT
+
+# Add Server-Timing headers with per-stage durations to every response
+TIMING_HEADERS = os.environ.get('TIMING_HEADERS', '0') not in ('0', 'false', 'no')
+
+# --- Metrics ---
+
+METRIC_DEFINITIONS = {
+    'http_requests_total': ('counter', 'GitHub HTTP responses received, by endpoint kind and status.'),
+    'http_bytes_fetched_total': ('counter', 'Response body bytes received from GitHub, by endpoint kind.'),
+    'content_cache_total': ('counter', 'Content cache lookups, by kind (blob/listing) and result.'),
+    'parse_cache_total': ('counter', 'Parse-result cache lookups, by result.'),
+    'yaml_parse_seconds': ('summary', 'Time spent parsing YAML files.'),
+    'sql_parse_seconds': ('summary', 'Time spent parsing SQL, by extractor path (fast/full).'),
+    'replacements_total': ('counter', 'Table references replaced with ref()/source() calls.'),
+    'translations_total': ('counter', 'Translations performed, by result.'),
+    'stage_seconds': ('summary', 'Time spent in each load/translate stage.'),
+    'request_seconds': ('summary', 'Time spent handling HTTP requests, by endpoint.'),
+    'load_jobs_total': ('counter', 'Background project loads, by result (started/joined/done/failed).'),
+}
+
+
+class Metrics:
+    """
+    Process-local counters and timing summaries, rendered in the Prometheus text format.
+    Each worker process keeps its own values (batch translation workers are not included).
+    """
+
+    def __init__(self, namespace, definitions):
+        self.namespace = namespace
+        self.definitions = definitions
+        self._counters = {}
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self._summaries.setdefault(key, [0, 0.0])
+            summary[0] += 1
+            summary[1] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), chr(92) + "n")}"' for key, value in labels)
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = {key: list(value) for key, value in self._summaries.items()}
+        lines = []
+        for name, (kind, help_text) in self.definitions.items():
+            full_name = f'{self.namespace}_{name}'
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{full_name}{self._format_labels(labels)} {value}')
+            else:
+                for (metric, labels), (count, total) in sorted(summaries.items()):
+                    if metric == name:
+                        lines.append(f'{full_name}_count{self._format_labels(labels)} {count}')
+                        lines.append(f'{full_name}_sum{self._format_labels(labels)} {total}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics('sqltodbt', METRIC_DEFINITIONS)
+
+
+@contextmanager
+def timed_stage(stage):
+    """Times a load/translate stage into the stage_seconds metric and, within a request, the Server-Timing header."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('stage_seconds', elapsed, stage=stage)
+        if has_request_context():
+            g.setdefault('stage_timings', []).append((stage, elapsed))
+
+# --- Content Cache ---
+
+class ContentCache:
+    """
+    Persistent, content-addressed cache for one repository's fetched files.
+    Blobs are stored under blobs/<sha[:2]>/<sha> and shared by all repositories; each
+    repository also gets a manifest of directory listings. Listings of a directory at a
+    known git tree sha never change, so they are keyed by (tree sha, path) and reused
+    without a request; listings of a moving ref are keyed by URL with their ETags and
+    revalidated with If-None-Match. The manifest keeps at most `max_listings` entries and
+    blob storage is kept under `max_bytes`, both by evicting the least recently used.
+    """
+
+    def __init__(self, cache_dir, repo_key, max_bytes=CONTENT_CACHE_MAX_BYTES, max_listings=CONTENT_CACHE_MAX_LISTINGS):
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, 'blobs')
+        self.manifest_path = os.path.join(cache_dir, 'manifests', hashlib.sha256(repo_key.encode('utf-8')).hexdigest()[:24] + '.json')
+        self.max_bytes = max_bytes
+        self.max_listings = max_listings
+        self.stats = {'blob_hits': 0, 'blob_misses': 0, 'listing_hits': 0, 'listing_misses': 0}
+        self._lock = threading.Lock()
+        # Least recently used first; saved in this order so it survives a reload
+        self._listings = OrderedDict()
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if isinstance(manifest, dict) and isinstance(manifest.get('listings'), dict):
+                self._listings = OrderedDict((key, entry) for key, entry in manifest['listings'].items()
+                                             if key.startswith(('url:', 'tree:')))
+        except (OSError, ValueError):
+            pass
+
+    @classmethod
+    def for_repo(cls, repo_api_url):
+        """Returns the cache for a repository, or None when caching is disabled."""
+        if not CONTENT_CACHE_DIR:
+            return None
+        return cls(CONTENT_CACHE_DIR, repo_api_url)
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+        kind, result = stat.split('_')
+        metrics.inc('content_cache_total', kind=kind, result='hit' if result == 'hits' else 'miss')
+
+    def _blob_path(self, sha):
+        return os.path.join(self.blob_dir, sha[:2], sha)
+
+    def get_blob(self, sha):
+        """Returns cached content for a blob sha, or None. A hit refreshes the blob's LRU position."""
+        path = self._blob_path(sha)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except OSError:
+            self._count('blob_misses')
+            return None
+        self._count('blob_hits')
+        return content.decode('utf-8', errors='ignore')
+
+    def put_blob(self, sha, content):
+        path = self._blob_path(sha)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content.encode('utf-8'))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write cache blob %s: %s", sha, e)
+
+    def _get_entry(self, key):
+        with self._lock:
+            entry = self._listings.get(key)
+            if entry:
+                self._listings.move_to_end(key)
+        return entry
+
+    def _put_entry(self, key, entry):
+        with self._lock:
+            self._listings[key] = entry
+            self._listings.move_to_end(key)
+            while len(self._listings) > self.max_listings:
+                self._listings.popitem(last=False)
+
+    def get_listing(self, url):
+        """Returns (etag, items) for a cached listing of a moving ref, or (None, None)."""
+        entry = self._get_entry(f"url:{url}")
+        if not entry:
+            return None, None
+        return entry.get('etag'), entry.get('items')
+
+    def put_listing(self, url, etag, items):
+        if etag:
+            self._put_entry(f"url:{url}", {'etag': etag, 'items': items})
+
+    def get_tree_listing(self, tree_sha, path):
+        """Returns the cached listing of directory `path` at git tree `tree_sha`, or None."""
+        entry = self._get_entry(f"tree:{tree_sha}:{path}")
+        return entry.get('items') if entry else None
+
+    def put_tree_listing(self, tree_sha, path, items):
+        self._put_entry(f"tree:{tree_sha}:{path}", {'items': items})
+
+    def record_listing(self, hit):
+        self._count('listing_hits' if hit else 'listing_misses')
+
+    def save(self):
+        """Writes the manifest and evicts least recently used blobs beyond max_bytes."""
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            tmp_path = f"{self.manifest_path}.{threading.get_ident()}.tmp"
+            with self._lock:
+                manifest = {'listings': dict(self._listings)}
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            logger.warning("Could not write cache manifest %s: %s", self.manifest_path, e)
+        self.evict()
+
+    def evict(self):
+        blobs = []
+        total = 0
+        try:
+            for prefix in os.scandir(self.blob_dir):
+                if not prefix.is_dir(): continue
+                for entry in os.scandir(prefix.path):
+                    stat = entry.stat()
+                    blobs.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        except OSError:
+            return
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(blobs):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+# --- Project Store ---
+
+def project_to_json(project):
+    """The project without its derived resolution index, which project_from_json rebuilds."""
+    return {key: value for key, value in project.items() if key != 'resolution_index'}
+
+
+def project_from_json(project):
+    """Restores the tuples JSON turned into lists in a decoded project dict."""
+    project['reference_map'] = {name: tuple(ref) for name, ref in project['reference_map'].items()}
+    provenance = project.get('provenance')
+    if provenance:
+        provenance['yaml_tables'] = {path: [source_table_from_json(values) for values in tables] for path, tables in provenance['yaml_tables'].items()}
+    if 'file_paths' not in project:
+        # Stored before projects carried a path index
+        project.pop('file_tree', None)
+        project['file_paths'] = create_path_index(provenance['file_order'] if provenance else [])
+    # Derived from the map and provenance; rebuilding is cheaper than restoring its tuples
+    project['resolution_index'] = build_resolution_index(project['reference_map'], provenance)
+    return project
+
+
+def make_project_id(repo_url, commit_sha):
+    """Project handle for a repository at a given commit; this is all the session holds."""
+    return hashlib.sha256(f"{repo_url}@{commit_sha}".encode('utf-8')).hexdigest()[:32]
+
+
+def digest_files_content(files_content):
+    """Stable digest of fetched files, used in place of a commit sha when the sha is unknown."""
+    digest = hashlib.sha1()
+    for file_path in sorted(files_content):
+        digest.update(file_path.encode('utf-8') + b'\0')
+        digest.update(files_content[file_path].encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+class MemoryProjectStore:
+    """
+    In-process registry of loaded projects, keyed by project id.
+    Projects are immutable once stored, so every request shares the same copy.
+    Keeps at most `max_projects`, dropping the least recently used.
+    Also holds the records load jobs publish (see LoadJob.record), for LOAD_JOB_TTL seconds.
+    """
+
+    def __init__(self, max_projects=PROJECT_STORE_MAX_IN_MEMORY):
+        self.max_projects = max_projects
+        self._projects = OrderedDict()
+        self._latest = {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def get(self, project_id):
+        if not project_id:
+            return None
+        with self._lock:
+            project = self._projects.get(project_id)
+            if project is not None:
+                self._projects.move_to_end(project_id)
+            return project
+
+    def contains(self, project_id):
+        with self._lock:
+            return project_id in self._projects
+
+    def put(self, project_id, project, replace_latest=True):
+        """Stores a project. With replace_latest=False it only becomes the repository's latest if it has none."""
+        with self._lock:
+            self._projects[project_id] = project
+            self._projects.move_to_end(project_id)
+            if replace_latest:
+                self._latest[project.get('repo_url')] = project_id
+            else:
+                self._latest.setdefault(project.get('repo_url'), project_id)
+            while len(self._projects) > self.max_projects:
+                self._projects.popitem(last=False)
+
+    def latest(self, repo_url):
+        """Returns the most recently stored project for a repository, or None."""
+        with self._lock:
+            project_id = self._latest.get(repo_url)
+        return self.get(project_id)
+
+    def put_job(self, record):
+        with self._lock:
+            self._jobs[record['job_id']] = dict(record, updated_at=time.time())
+
+    def get_job(self, job_id):
+        """Returns a load job's last published record (with its updated_at), or None."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def claim_job(self, record):
+        """
+        Publishes a new job's record unless a live queued or running job with the same key is
+        already recorded; returns that job's record if so, else None.
+        """
+        now = time.time()
+        with self._lock:
+            for job_id in [job_id for job_id, other in self._jobs.items() if other['updated_at'] < now - LOAD_JOB_TTL]:
+                del self._jobs[job_id]
+            for other in self._jobs.values():
+                if (other['key'] == record['key'] and other['state'] in ('queued', 'running')
+                        and other['updated_at'] >= now - LOAD_JOB_STALE_AFTER):
+                    return other
+            self._jobs[record['job_id']] = dict(record, updated_at=now)
+        return None
+
+
+class SQLiteProjectStore:
+    """
+    Project registry persisted in a SQLite file, so all worker processes share loaded projects.
+    Deserialized projects are memoized in a MemoryProjectStore, so a project is decoded
+    once per process rather than on every request. Keeps at most `max_per_repo` projects per
+    repository, dropping the least recently stored other than the latest. Load job records live here too, so every
+    worker can report on, and join, a load running in another one.
+    """
+
+    def __init__(self, db_path, max_in_memory=PROJECT_STORE_MAX_IN_MEMORY, max_per_repo=PROJECT_STORE_MAX_PER_REPO):
+        self.db_path = db_path
+        self.max_per_repo = max_per_repo
+        self._memory = MemoryProjectStore(max_in_memory)
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS projects (project_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL, repo_url TEXT)')
+            if 'repo_url' not in [column[1] for column in conn.execute('PRAGMA table_info(projects)')]:
+                # Stores created before eviction; rows whose repository can't be read back are never evicted
+                conn.execute('ALTER TABLE projects ADD COLUMN repo_url TEXT')
+                try:
+                    conn.execute("UPDATE projects SET repo_url = json_extract(data, '$.repo_url')")
+                except sqlite3.OperationalError as e:
+                    logger.warning("Could not backfill repository URLs in %s: %s", db_path, e)
+            conn.execute('CREATE INDEX IF NOT EXISTS projects_by_repo ON projects (repo_url, updated_at)')
+            conn.execute('CREATE TABLE IF NOT EXISTS latest_projects (repo_url TEXT PRIMARY KEY, project_id TEXT NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS load_jobs (job_id TEXT PRIMARY KEY, job_key TEXT NOT NULL, state TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS load_jobs_by_key ON load_jobs (job_key, state)')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, project_id):
+        if not project_id:
+            return None
+        project = self._memory.get(project_id)
+        if project is not None:
+            return project
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT data FROM projects WHERE project_id = ?', (project_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        project = project_from_json(json.loads(row[0]))
+        self._memory.put(project_id, project)
+        return project
+
+    def contains(self, project_id):
+        if self._memory.contains(project_id):
+            return True
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT 1 FROM projects WHERE project_id = ?', (project_id,)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def put(self, project_id, project, replace_latest=True):
+        """
+        Stores a project. With replace_latest=False it only becomes the repository's latest if it has none.
+        Then drops the repository's least recently stored projects beyond max_per_repo.
+        """
+        repo_url = project.get('repo_url')
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO projects (project_id, data, updated_at, repo_url) VALUES (?, ?, ?, ?)',
+                             (project_id, json.dumps(project_to_json(project)), time.time(), repo_url))
+                conn.execute(f"INSERT OR {'REPLACE' if replace_latest else 'IGNORE'} INTO latest_projects (repo_url, project_id) VALUES (?, ?)",
+                             (repo_url, project_id))
+                conn.execute('DELETE FROM projects WHERE repo_url = ? '
+                             'AND project_id NOT IN (SELECT project_id FROM latest_projects WHERE repo_url = ?) '
+                             'AND project_id NOT IN (SELECT project_id FROM projects WHERE repo_url = ? ORDER BY updated_at DESC LIMIT ?)',
+                             (repo_url, repo_url, repo_url, self.max_per_repo))
+        finally:
+            conn.close()
+        self._memory.put(project_id, project, replace_latest)
+
+    def latest(self, repo_url):
+        """Returns the most recently stored project for a repository, or None."""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT project_id FROM latest_projects WHERE repo_url = ?', (repo_url,)).fetchone()
+        finally:
+            conn.close()
+        return self.get(row[0]) if row else None
+
+    def _write_job(self, conn, record, now):
+        conn.execute('INSERT OR REPLACE INTO load_jobs (job_id, job_key, state, data, updated_at) VALUES (?, ?, ?, ?, ?)',
+                     (record['job_id'], record['key'], record['state'], json.dumps(record), now))
+
+    def put_job(self, record):
+        conn = self._connect()
+        try:
+            with conn:
+                self._write_job(conn, record, time.time())
+        finally:
+            conn.close()
+
+    def get_job(self, job_id):
+        """Returns a load job's last published record (with its updated_at), or None."""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT data, updated_at FROM load_jobs WHERE job_id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(json.loads(row[0]), updated_at=row[1]) if row else None
+
+    def claim_job(self, record):
+        """
+        Publishes a new job's record unless a live queued or running job with the same key is
+        already recorded; returns that job's record if so, else None. Atomic across processes.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('DELETE FROM load_jobs WHERE updated_at < ?', (now - LOAD_JOB_TTL,))
+                row = conn.execute("SELECT data, updated_at FROM load_jobs WHERE job_key = ? AND state IN ('queued', 'running') "
+                                   'AND updated_at >= ? ORDER BY updated_at DESC LIMIT 1', (record['key'], now - LOAD_JOB_STALE_AFTER)).fetchone()
+                if row:
+                    return dict(json.loads(row[0]), updated_at=row[1])
+                self._write_job(conn, record, now)
+        finally:
+            conn.close()
+        return None
+
+
+def create_project_store(backend=None):
+    """Creates the configured project store backend."""
+    backend = backend or PROJECT_STORE_BACKEND
+    if backend == 'sqlite':
+        return SQLiteProjectStore(PROJECT_STORE_PATH)
+    if backend != 'memory':
+        logger.warning("Unknown project store backend '%s'. Using 'memory'.", backend)
+    return MemoryProjectStore()
+
+
+project_store = create_project_store()
 
 # --- Helper Functions (Largely unchanged, but return values adapted) ---
 
@@ -34,92 +642,755 @@ def get_github_api_url(github_repo_url):
     else:
         return None
 
-def fetch_github_repo_files(repo_api_url, path=""):
+def get_github_repo_api_base(repo_api_url):
+    """Strips the trailing 'contents/' from a contents API URL, giving the repository API base URL."""
+    if repo_api_url.endswith('contents/'):
+        return repo_api_url[:-len('contents/')]
+    return repo_api_url
+
+
+def github_request_headers():
+    """Base headers for GitHub API calls. Uses GITHUB_TOKEN, if set, for private repos/rate limits."""
+    headers = {}
+    token = os.environ.get('GITHUB_TOKEN')
+    if token:
+        headers['Authorization'] = f'token {token}'
+    return headers
+
+
+def get_github_head_sha(repo_api_url, http_session=None):
+    """Returns the commit sha of the repository's default branch head, or None if it can't be resolved."""
+    commit_url = f"{get_github_repo_api_base(repo_api_url)}commits/HEAD"
+    headers = github_request_headers()
+    headers['Accept'] = 'application/vnd.github.sha'
+    owns_session = http_session is None
+    if owns_session:
+        http_session = create_http_session(1)
+    try:
+        response = http_session.get(commit_url, headers=headers, timeout=15)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logger.warning("Could not resolve head commit for %s: %s", repo_api_url, e)
+        return None
+    finally:
+        if owns_session:
+            http_session.close()
+    sha = response.text.strip()
+    return sha if re.fullmatch(r'[0-9a-f]{40}', sha) else None
+
+
+def is_model_sql_file(file_path):
+    """Returns True for dbt model .sql files under models/."""
+    return file_path.startswith(MODELS_DIR + '/') and file_path.endswith('.sql')
+
+
+def is_relevant_dbt_file(file_path):
+    """Returns True for dbt model .sql files under models/ and any .yml file."""
+    return is_model_sql_file(file_path) or file_path.endswith('.yml')
+
+
+def create_http_session(pool_size=None):
     """
-    Recursively fetches file paths and content relevant for dbt models/sources.
-    Returns a dictionary {file_path: file_content_string} or None on major error.
+    Creates a pooled requests.Session shared by all fetch workers.
+    Retries transient failures (connection errors, 429 and 5xx) with exponential backoff.
     """
-    # (Keep the implementation from the previous version, ensuring it returns None on critical errors)
-    # ... (fetch_github_repo_files implementation from previous version) ...
-    files_content = {}
-    headers = {} # Add {'Authorization': f'token YOUR_GITHUB_TOKEN'} for private repos/rate limits
+    pool_size = pool_size or FETCH_MAX_WORKERS
+    retry = Retry(
+        total=FETCH_MAX_RETRIES,
+        backoff_factor=FETCH_BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    http_session = requests.Session()
+    http_session.mount('https://', adapter)
+    http_session.mount('http://', adapter)
+    http_session.hooks['response'].append(_record_http_response)
+    return http_session
+
+
+def _github_endpoint_kind(url):
+    path = urlparse(url).path
+    for marker, kind in (('/contents/', 'listing'), ('/git/trees/', 'tree'), ('/tarball', 'tarball'), ('/compare/', 'compare'), ('/commits/', 'commit')):
+        if marker in path:
+            return kind
+    return 'file'
+
+
+def _record_http_response(response, *args, **kwargs):
+    """Session response hook counting requests and bytes. Streamed bodies are counted by Content-Length."""
+    kind = _github_endpoint_kind(response.url)
+    metrics.inc('http_requests_total', kind=kind, status=str(response.status_code))
+    if kwargs.get('stream'):
+        size = int(response.headers.get('Content-Length') or 0)
+    else:
+        size = len(response.content)
+    metrics.inc('http_bytes_fetched_total', size, kind=kind)
+
+
+def _get_listing_json(http_session, url, headers, timeout, cache=None):
+    """
+    GETs a JSON listing, revalidating a cached copy with If-None-Match when one exists.
+    Raises requests exceptions like a plain GET would.
+    """
+    cached_etag, cached_items = cache.get_listing(url) if cache else (None, None)
+    if cached_etag and cached_items is not None:
+        headers = dict(headers, **{'If-None-Match': cached_etag})
+    response = http_session.get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and cached_items is not None:
+        cache.record_listing(hit=True)
+        return cached_items
+    response.raise_for_status()
+    data = response.json()
+    if cache:
+        cache.record_listing(hit=False)
+        cache.put_listing(url, response.headers.get('ETag'), data)
+    return data
+
+
+def _list_github_directory(http_session, repo_api_url, path, headers, cache=None, ref=None, tree_sha=None):
+    """
+    Lists one directory via the contents API, at `ref` if given (else the default branch).
+    `tree_sha` is the directory's git tree sha from its parent listing; a cached listing of
+    that tree is returned without a request.
+    Returns a list of item dicts, or None on a critical error.
+    """
+    if cache and tree_sha:
+        items = cache.get_tree_listing(tree_sha, path)
+        if items is not None:
+            cache.record_listing(hit=True)
+            return items
 
-    current_api_url = repo_api_url + path
-    print(f"Fetching contents from: {current_api_url}") # Keep logging for debug
+    current_api_url = repo_api_url + path + (f"?ref={ref}" if ref else '')
+    logger.debug("Fetching contents from: %s", current_api_url)
 
     try:
         list_headers = headers.copy()
         list_headers['Accept'] = 'application/vnd.github.v3+json'
-        # Increased timeout slightly for potentially larger repos
-        response = requests.get(current_api_url, headers=list_headers, timeout=20)
-        response.raise_for_status()
-        items = response.json()
-
-        if isinstance(items, dict) and items.get('type') == 'file':
-             items = [items]
-        elif not isinstance(items, list):
-             print(f"Warning: Expected list from API for path '{path}', got {type(items)}. Skipping.")
-             return files_content # Return empty dict for this path, not necessarily fatal
-
-        for item in items:
-            if not isinstance(item, dict): continue
-            item_path = item.get('path')
-            item_type = item.get('type')
-            if not item_path or not item_type: continue
-
-            if item_type == 'file':
-                is_model_sql = item_path.startswith(MODELS_DIR + '/') and item_path.endswith('.sql')
-                is_schema_yml = item_path.endswith('.yml')
-
-                if is_model_sql or is_schema_yml:
-                    print(f"  Fetching relevant file: {item_path}")
-                    try:
-                        content_url = item.get('download_url')
-                        fetch_headers = headers.copy()
-                        if not content_url:
-                             content_url = item.get('url')
-                             if not content_url: continue
-                             print(f"  Attempting fetch via API URL: {content_url}")
-                             fetch_headers['Accept'] = 'application/vnd.github.v3.raw'
-                        else:
-                             print(f"  Fetching via download_url: {content_url}")
-
-                        # Increased timeout for file download
-                        file_response = requests.get(content_url, headers=fetch_headers, timeout=15)
-                        file_response.raise_for_status()
-                        files_content[item_path] = file_response.content.decode('utf-8', errors='ignore')
-                    except requests.exceptions.RequestException as e:
-                        print(f"Warning: Could not fetch file content for {item_path}: {e}")
-                    except Exception as e:
-                         print(f"Warning: Error processing file content for {item_path}: {e}")
-
-            elif item_type == 'dir':
-                if item_path == '.git': continue
-                print(f"  Entering directory: {item_path}")
-                subdir_content = fetch_github_repo_files(repo_api_url, item_path)
-                if subdir_content: # Check if recursive call returned content
-                    files_content.update(subdir_content)
-
+        # Increased timeout slightly for potentially larger repos.
+        # A listing pinned to a commit is never revalidated, so it isn't kept by URL.
+        items = _get_listing_json(http_session, current_api_url, list_headers, 20, None if ref else cache)
+        if cache and ref:
+            cache.record_listing(hit=False)
     except requests.exceptions.HTTPError as e:
-        print(f"HTTP Error fetching {current_api_url}: {e.response.status_code}")
+        logger.error("HTTP Error fetching %s: %s", current_api_url, e.response.status_code)
         return None # Indicate critical fetch failure for this path/repo
     except requests.exceptions.RequestException as e:
-        print(f"Network Error fetching {current_api_url}: {e}")
+        logger.error("Network Error fetching %s: %s", current_api_url, e)
         return None # Indicate critical fetch failure
     except Exception as e:
-        print(f"Unexpected error processing API response for {current_api_url}: {e}")
+        logger.error("Unexpected error processing API response for %s: %s", current_api_url, e)
         return None # Indicate critical failure
 
+    if isinstance(items, dict) and items.get('type') == 'file':
+         items = [items]
+    elif not isinstance(items, list):
+         logger.warning("Expected list from API for path '%s', got %s. Skipping.", path, type(items))
+         return [] # Empty listing for this path, not necessarily fatal
+    if cache and tree_sha:
+        cache.put_tree_listing(tree_sha, path, items)
+    return items
+
+
+def _fetch_github_file(http_session, item, headers, cache=None):
+    """
+    Downloads one file item. Returns its decoded content, or None if it could not be fetched.
+    Items carrying a blob sha are served from, and stored into, the content cache.
+    """
+    item_path = item.get('path')
+    sha = item.get('sha')
+    if cache and sha:
+        content = cache.get_blob(sha)
+        if content is not None:
+            return content
+    logger.debug("Fetching relevant file: %s", item_path)
+    try:
+        content_url = item.get('download_url')
+        fetch_headers = headers.copy()
+        if not content_url:
+             content_url = item.get('url')
+             if not content_url: return None
+             logger.debug("Attempting fetch via API URL: %s", content_url)
+             fetch_headers['Accept'] = 'application/vnd.github.v3.raw'
+        else:
+             logger.debug("Fetching via download_url: %s", content_url)
+
+        # Increased timeout for file download
+        file_response = http_session.get(content_url, headers=fetch_headers, timeout=15)
+        file_response.raise_for_status()
+        content = file_response.content.decode('utf-8', errors='ignore')
+        if cache and sha:
+            cache.put_blob(sha, content)
+        return content
+    except requests.exceptions.RequestException as e:
+        logger.warning("Could not fetch file content for %s: %s", item_path, e)
+    except Exception as e:
+         logger.warning("Error processing file content for %s: %s", item_path, e)
+    return None
+
+
+def fetch_github_repo_files(repo_api_url, path="", max_workers=None, http_session=None, cache=None, progress=None, ref=None):
+    """
+    Fetches file paths and content relevant for dbt models/sources, at `ref` if given.
+    Directory listings and file downloads run concurrently on a bounded thread pool
+    sharing one pooled HTTP session; at most `max_workers` requests are in flight.
+    With a ContentCache, subdirectories whose tree sha is unchanged are not listed again, other
+    listings are revalidated by ETag, and unchanged blobs are not re-downloaded.
+    `progress` (see LoadJob) is told about each listing and file, and gets sources_ready once.
+    Returns a dictionary {file_path: file_content_string} or None on major error.
+    """
+    max_workers = max_workers or FETCH_MAX_WORKERS
+    headers = github_request_headers()
+    owns_session = http_session is None
+    if owns_session:
+        http_session = create_http_session(max_workers)
+
+    files_content = {}
+    # Position of each file in a depth-first walk of the listings, so the result keeps
+    # the same order the serial recursion produced (later duplicates still win).
+    walk_order = {}
+    # Every relevant path seen so far (fetched or not), and the listings and YAML files still outstanding
+    known_order = {}
+    pending_dirs, pending_yaml = 1, 0
+    sources_announced = progress is None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {executor.submit(_list_github_directory, http_session, repo_api_url, path, headers, cache, ref): ('dir', path, ())}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, item_path, order_key = pending.pop(future)
+                    result = future.result()
+
+                    if kind == 'file':
+                        if result is not None:
+                            files_content[item_path] = result
+                            walk_order[item_path] = order_key
+                        else:
+                            known_order.pop(item_path, None)
+                        if item_path.endswith('.yml'):
+                            pending_yaml -= 1
+                        if progress:
+                            progress.file_fetched(item_path, len(result.encode('utf-8')) if result is not None else 0)
+                        continue
+
+                    if result is None:
+                        for other in pending:
+                            other.cancel()
+                        return None # A directory listing failed; treat the whole fetch as failed
+                    pending_dirs -= 1
+                    if progress:
+                        progress.directory_listed(item_path)
+
+                    for index, item in enumerate(result):
+                        if not isinstance(item, dict): continue
+                        child_path = item.get('path')
+                        child_type = item.get('type')
+                        if not child_path or not child_type: continue
+                        child_key = order_key + (index,)
+
+                        if child_type == 'file' and is_relevant_dbt_file(child_path):
+                            future = executor.submit(_fetch_github_file, http_session, item, headers, cache)
+                            pending[future] = ('file', child_path, child_key)
+                            known_order[child_path] = child_key
+                            if child_path.endswith('.yml'):
+                                pending_yaml += 1
+                        elif child_type == 'dir':
+                            if child_path == '.git': continue
+                            logger.debug("Entering directory: %s", child_path)
+                            future = executor.submit(_list_github_directory, http_session, repo_api_url, child_path, headers, cache, ref, item.get('sha'))
+                            pending[future] = ('dir', child_path, child_key)
+                            pending_dirs += 1
+
+                if not sources_announced and pending_dirs == 0 and pending_yaml == 0:
+                    # Every path is known and every YAML file is in: the reference map can be built now.
+                    # Model names only need paths, so SQL files still downloading are passed as ''.
+                    sources_announced = True
+                    progress.sources_ready({file_path: files_content.get(file_path, '')
+                                            for file_path in sorted(known_order, key=known_order.get)})
+    finally:
+        if owns_session:
+            http_session.close()
+
+    return {file_path: files_content[file_path] for file_path in sorted(files_content, key=walk_order.get)}
+
+
+def fetch_github_repo_tree(repo_api_url, ref='HEAD', max_workers=None, http_session=None, cache=None, progress=None):
+    """
+    Lists the whole repository with a single git trees API call (recursive=1), then
+    downloads the relevant blobs concurrently, YAML files first. Falls back to the
+    per-directory walk when GitHub truncates the tree listing.
+    `progress` is reported to as in fetch_github_repo_files.
+    Returns a dictionary {file_path: file_content_string} or None on major error.
+    """
+    max_workers = max_workers or FETCH_MAX_WORKERS
+    headers = github_request_headers()
+    owns_session = http_session is None
+    if owns_session:
+        http_session = create_http_session(max_workers)
+
+    tree_url = f"{get_github_repo_api_base(repo_api_url)}git/trees/{ref}?recursive=1"
+    logger.debug("Fetching tree from: %s", tree_url)
+    try:
+        try:
+            list_headers = headers.copy()
+            list_headers['Accept'] = 'application/vnd.github.v3+json'
+            # Only the moving HEAD listing is worth revalidating; a commit's tree is fetched once per load
+            tree_data = _get_listing_json(http_session, tree_url, list_headers, 30, cache if ref == 'HEAD' else None)
+            if cache and ref != 'HEAD':
+                cache.record_listing(hit=False)
+        except requests.exceptions.HTTPError as e:
+            logger.error("HTTP Error fetching %s: %s", tree_url, e.response.status_code)
+            return None
+        except requests.exceptions.RequestException as e:
+            logger.error("Network Error fetching %s: %s", tree_url, e)
+            return None
+        except Exception as e:
+            logger.error("Unexpected error processing API response for %s: %s", tree_url, e)
+            return None
+
+        if not isinstance(tree_data, dict) or not isinstance(tree_data.get('tree'), list):
+            logger.warning("Unexpected tree response from %s.", tree_url)
+            return None
+        if tree_data.get('truncated'):
+            logger.warning("Tree listing was truncated by GitHub. Falling back to per-directory fetch.")
+            return fetch_github_repo_files(repo_api_url, max_workers=max_workers, http_session=http_session, cache=cache, progress=progress,
+                                           ref=None if ref == 'HEAD' else ref)
+
+        blobs = [item for item in tree_data['tree']
+                 if isinstance(item, dict) and item.get('type') == 'blob'
+                 and item.get('path') and is_relevant_dbt_file(item['path'])]
+
+        if progress:
+            progress.directory_listed('')
+
+        fetched = {}
+        known_paths = [item['path'] for item in blobs]
+        pending_yaml = sum(1 for file_path in known_paths if file_path.endswith('.yml'))
+        sources_announced = progress is None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # YAML first, so the sources (and with them a usable reference map) are in early
+            futures = {executor.submit(_fetch_github_file, http_session, item, headers, cache): item['path']
+                       for item in sorted(blobs, key=lambda item: not item['path'].endswith('.yml'))}
+            for future in as_completed(futures):
+                file_path = futures[future]
+                content = future.result()
+                fetched[file_path] = content
+                if file_path.endswith('.yml'):
+                    pending_yaml -= 1
+                if progress:
+                    progress.file_fetched(file_path, len(content.encode('utf-8')) if content is not None else 0)
+                    if not sources_announced and pending_yaml == 0:
+                        sources_announced = True
+                        # Files that failed are left out; SQL files still downloading are passed as ''
+                        progress.sources_ready({p: fetched.get(p, '') for p in known_paths
+                                                if p not in fetched or fetched[p] is not None})
+        return {file_path: fetched[file_path] for file_path in known_paths if fetched[file_path] is not None}
+    finally:
+        if owns_session:
+            http_session.close()
+
+
+def read_tarball_files(fileobj, mode='r|gz', progress=None):
+    """
+    Streams a repository tarball (as produced by GitHub's tarball endpoint) and extracts
+    only the relevant dbt files in memory. The archive's top-level '<owner>-<repo>-<sha>/'
+    directory is stripped from member paths.
+    Returns a dictionary {file_path: file_content_string}.
+    """
+    files_content = {}
+    with tarfile.open(fileobj=fileobj, mode=mode) as archive:
+        for member in archive:
+            if not member.isfile(): continue
+            parts = member.name.split('/', 1)
+            if len(parts) < 2 or not parts[1]: continue
+            file_path = parts[1]
+            if not is_relevant_dbt_file(file_path): continue
+            extracted = archive.extractfile(member)
+            if extracted is None: continue
+            data = extracted.read()
+            files_content[file_path] = data.decode('utf-8', errors='ignore')
+            if progress:
+                progress.file_fetched(file_path, len(data))
+    return files_content
+
+
+def fetch_github_repo_tarball(repo_api_url, ref='', http_session=None, progress=None):
+    """
+    Downloads the repository as a single tarball and streams the relevant members out of it.
+    Returns a dictionary {file_path: file_content_string} or None on major error.
+    """
+    owns_session = http_session is None
+    if owns_session:
+        http_session = create_http_session(1)
+
+    tarball_url = f"{get_github_repo_api_base(repo_api_url)}tarball/{ref}"
+    logger.debug("Fetching tarball from: %s", tarball_url)
+    try:
+        with http_session.get(tarball_url, headers=github_request_headers(), timeout=60, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            return read_tarball_files(response.raw, progress=progress)
+    except requests.exceptions.HTTPError as e:
+        logger.error("HTTP Error fetching %s: %s", tarball_url, e.response.status_code)
+        return None
+    except requests.exceptions.RequestException as e:
+        logger.error("Network Error fetching %s: %s", tarball_url, e)
+        return None
+    except tarfile.TarError as e:
+        logger.error("Error reading tarball from %s: %s", tarball_url, e)
+        return None
+    finally:
+        if owns_session:
+            http_session.close()
+
+
+def fetch_github_changed_files(repo_api_url, base_sha, head_sha, max_workers=None, http_session=None, cache=None):
+    """
+    Lists the files changed between two commits with the compare API and downloads the
+    relevant ones. Renames are reported as a deletion plus an addition.
+    Returns {file_path: new_content, or None if deleted}, or None when the comparison
+    is unavailable, too large (GitHub lists at most 300 files) or not a fast-forward from
+    base to head, and a full load is needed.
+    """
+    max_workers = max_workers or FETCH_MAX_WORKERS
+    headers = github_request_headers()
+    owns_session = http_session is None
+    if owns_session:
+        http_session = create_http_session(max_workers)
+
+    compare_url = f"{get_github_repo_api_base(repo_api_url)}compare/{base_sha}...{head_sha}"
+    logger.debug("Fetching changes from: %s", compare_url)
+    try:
+        try:
+            list_headers = headers.copy()
+            list_headers['Accept'] = 'application/vnd.github.v3+json'
+            response = http_session.get(compare_url, headers=list_headers, timeout=30)
+            response.raise_for_status()
+            comparison = response.json()
+            status, changed = comparison.get('status'), comparison.get('files')
+        except requests.exceptions.RequestException as e:
+            logger.warning("Could not compare %s...%s: %s", base_sha, head_sha, e)
+            return None
+        except ValueError as e:
+            logger.warning("Unexpected compare response from %s: %s", compare_url, e)
+            return None
+        # base...head diffs from the merge base: after a force push or rollback ('diverged'/'behind')
+        # changes only on the old base would never be undone, so only a fast-forward is applied
+        if status not in ('ahead', 'identical'):
+            logger.info("Compare %s...%s is '%s'; a full load is needed.", base_sha, head_sha, status)
+            return None
+        if not isinstance(changed, list) or len(changed) >= GITHUB_COMPARE_MAX_FILES:
+            return None
+
+        changed_files = {}
+        to_fetch = []
+        for item in changed:
+            if not isinstance(item, dict) or not item.get('filename'): continue
+            file_path = item['filename']
+            previous_path = item.get('previous_filename')
+            if previous_path and previous_path != file_path and is_relevant_dbt_file(previous_path):
+                changed_files[previous_path] = None
+            if not is_relevant_dbt_file(file_path): continue
+            if item.get('status') == 'removed':
+                changed_files[file_path] = None
+            else:
+                to_fetch.append({'path': file_path, 'sha': item.get('sha'), 'download_url': item.get('raw_url'), 'url': item.get('contents_url')})
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_fetch_github_file, http_session, item, headers, cache) for item in to_fetch]
+            for item, future in zip(to_fetch, futures):
+                content = future.result()
+                if content is None:
+                    return None # A changed file is missing; the incremental result would be wrong
+                changed_files[item['path']] = content
+        return changed_files
+    finally:
+        if owns_session:
+            http_session.close()
+
+
+def fetch_dbt_project_files(repo_api_url, ingest_mode=None, cache=None, progress=None, commit_sha=None):
+    """
+    Fetches the relevant dbt files using the requested ingest mode, pinned to `commit_sha` when
+    given so a push to the default branch mid-fetch can't mix in files from a newer commit.
+    The content cache applies to the 'contents' and 'tree' modes, which expose blob shas.
+    Only those modes know every path before the files are in, so only they call progress.sources_ready.
+    """
+    ingest_mode = ingest_mode or DEFAULT_INGEST_MODE
+    if ingest_mode == 'tree':
+        files_content = fetch_github_repo_tree(repo_api_url, ref=commit_sha or 'HEAD', cache=cache, progress=progress)
+    elif ingest_mode == 'tarball':
+        return fetch_github_repo_tarball(repo_api_url, ref=commit_sha or '', progress=progress)
+    else:
+        files_content = fetch_github_repo_files(repo_api_url, cache=cache, progress=progress, ref=commit_sha)
+    if cache and files_content is not None:
+        cache.save()
+    return files_content
+
+
+def local_repo_url(root):
+    """Repository key for a local directory, used in place of a GitHub API URL."""
+    return 'file://' + os.path.realpath(root)
+
+
+def resolve_local_project_root(location):
+    """
+    Returns the real path of a local directory (plain path or file:// URL) when it lies under
+    one of LOCAL_PROJECT_ROOTS, otherwise None.
+    """
+    if not LOCAL_PROJECT_ROOTS or not location:
+        return None
+    path = location[len('file://'):] if location.startswith('file://') else location
+    if not os.path.isabs(path):
+        return None
+    path = os.path.realpath(path)
+    if not os.path.isdir(path):
+        return None
+    for allowed_root in LOCAL_PROJECT_ROOTS:
+        if os.path.commonpath([path, allowed_root]) == allowed_root:
+            return path
+    return None
+
+
+def _run_git(root, *args, input_bytes=None):
+    """Runs a git command in `root`, returning its stdout as bytes, or None if it fails."""
+    try:
+        result = subprocess.run(['git', '-C', root, *args], input=input_bytes, capture_output=True, timeout=120)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning("Could not run git in %s: %s", root, e)
+        return None
+    if result.returncode != 0:
+        logger.debug("git %s failed in %s: %s", args[0], root, result.stderr.decode('utf-8', errors='ignore').strip())
+        return None
+    return result.stdout
+
+
+def resolve_git_ref(root, ref):
+    """Returns the commit sha a ref (branch, tag or sha) points to in a local git repository, or None."""
+    if not ref or ref.startswith('-'):
+        return None
+    output = _run_git(root, 'rev-parse', '--verify', '--quiet', ref + '^{commit}')
+    return output.decode('ascii').strip() if output else None
+
+
+def is_bare_git_repo(root):
+    """Returns True if root is a bare git repository (no working tree to read files from)."""
+    output = _run_git(root, 'rev-parse', '--is-bare-repository')
+    return output is not None and output.strip() == b'true'
+
+
+def has_uncommitted_changes(root):
+    """Returns True if the git working tree under root has modified, staged or untracked files."""
+    output = _run_git(root, 'status', '--porcelain', '--', '.')
+    return bool(output and output.strip())
+
+
+def read_local_project_files(root, max_workers=None, progress=None):
+    """
+    Reads the relevant dbt files from a local directory.
+    The tree is walked with os.scandir in the order the contents API walk uses (entries sorted
+    by name, depth first); only relevant files are opened, and they are read on a thread pool.
+    Returns a dictionary {file_path: file_content_string} with '/'-separated paths relative to root.
+    """
+    file_paths = []
+
+    def walk(directory, prefix):
+        try:
+            with os.scandir(directory) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError as e:
+            logger.warning("Could not list %s: %s", directory, e)
+            return
+        for entry in entries:
+            file_path = prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name != '.git':
+                    walk(entry.path, file_path + '/')
+            elif entry.is_file(follow_symlinks=False) and is_relevant_dbt_file(file_path):
+                file_paths.append((file_path, entry.path))
+
+    def read_file(paths):
+        file_path, full_path = paths
+        try:
+            with open(full_path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            logger.warning("Could not read %s: %s", full_path, e)
+            return None
+        if progress:
+            progress.file_fetched(file_path, len(data))
+        return data.decode('utf-8', errors='ignore')
+
+    walk(root, '')
+    with ThreadPoolExecutor(max_workers=max_workers or FETCH_MAX_WORKERS) as executor:
+        contents = executor.map(read_file, file_paths)
+        return {file_path: content for (file_path, _), content in zip(file_paths, contents) if content is not None}
+
+
+def read_git_project_files(root, ref, progress=None):
+    """
+    Reads the relevant dbt files from a local git repository (bare or not) at a commit,
+    without checking it out. Paths are listed with `git ls-tree` and all blobs are read
+    through a single `git cat-file --batch` process.
+    Returns a dictionary {file_path: file_content_string}, or None if the ref can't be read.
+    """
+    # Without --full-tree, a project in a subdirectory of the repository is listed relative to it
+    listing = _run_git(root, 'ls-tree', '-r', '-z', ref)
+    if listing is None:
+        return None
+    blobs = []
+    for record in listing.split(b'\0'):
+        if not record: continue
+        meta, _, raw_path = record.partition(b'\t')
+        mode, object_type, blob_sha = meta.split()
+        file_path = raw_path.decode('utf-8', errors='surrogateescape')
+        # Symlinks and submodules have no file content to translate
+        if object_type != b'blob' or mode == b'120000' or not is_relevant_dbt_file(file_path): continue
+        blobs.append((file_path, blob_sha))
+    if not blobs:
+        return {}
+
+    output = _run_git(root, 'cat-file', '--batch', input_bytes=b''.join(blob_sha + b'\n' for _, blob_sha in blobs))
+    if output is None:
+        return None
+    files_content = {}
+    position = 0
+    for file_path, _ in blobs:
+        header_end = output.index(b'\n', position)
+        size = int(output[position:header_end].split()[2])
+        content_start = header_end + 1
+        files_content[file_path] = output[content_start:content_start + size].decode('utf-8', errors='ignore')
+        position = content_start + size + 1
+        if progress:
+            progress.file_fetched(file_path, size)
     return files_content
 
 
-def build_reference_map(files_content):
+def read_local_project(root, ref=None):
+    """
+    Reads a local project: the working tree of a directory, or a git repository at `ref`.
+    Bare repositories are read at HEAD when no ref is given.
+    Returns (files_content, commit_sha). commit_sha is None for a working tree, whose contents
+    may not match any commit; files_content is None if the ref can't be read.
+    """
+    if ref is None and is_bare_git_repo(root):
+        ref = 'HEAD'
+    if ref is None:
+        return read_local_project_files(root), None
+    commit_sha = resolve_git_ref(root, ref)
+    if commit_sha is None:
+        logger.warning("Could not resolve ref '%s' in %s.", ref, root)
+        return None, None
+    return read_git_project_files(root, commit_sha), commit_sha
+
+
+# One table declared in a sources YAML file. schema defaults to the source name and identifier
+# to the table name, as in dbt; database is None unless the YAML sets it.
+SourceTable = namedtuple('SourceTable', ['source_name', 'table_name', 'database', 'schema', 'identifier'])
+
+
+def source_table_from_json(values):
+    """Restores a SourceTable from JSON, including [source_name, table_name] pairs stored by older versions."""
+    if len(values) == 2:
+        return SourceTable(values[0], values[1], None, values[0], values[1])
+    return SourceTable(*values)
+
+
+def _yaml_string(value):
+    return value if isinstance(value, str) and value else None
+
+
+def _load_yaml_source_tables(file_path, content):
+    """
+    Parses one YAML file without logging, so it can run in a worker process.
+    Returns (source_tables, warning_message or None, parse_seconds); source_tables is a list of SourceTable.
+    """
+    source_tables = []
+    started = time.perf_counter()
+    try:
+        data = yaml.load(content, Loader=YAML_LOADER)
+        if not isinstance(data, dict): return source_tables, None, time.perf_counter() - started
+
+        sources = data.get('sources')
+        if isinstance(sources, list):
+            for source_def in sources:
+                 if not isinstance(source_def, dict): continue
+                 source_name = source_def.get('name')
+                 tables = source_def.get('tables')
+                 if not source_name or not isinstance(tables, list): continue
+                 # Only string values are kept; anything else (or unset) falls back to dbt's defaults
+                 database = _yaml_string(source_def.get('database'))
+                 schema = _yaml_string(source_def.get('schema')) or source_name
+
+                 for table_def in tables:
+                     if not isinstance(table_def, dict): continue
+                     table_name = table_def.get('name')
+                     if table_name and isinstance(table_name, str):
+                         identifier = _yaml_string(table_def.get('identifier')) or table_name
+                         source_tables.append(SourceTable(source_name, table_name, database, schema, identifier))
+    except yaml.YAMLError as e:
+        return [], f"Error parsing YAML {file_path}: {e}", time.perf_counter() - started
+    except Exception as e:
+        return [], f"Unexpected error processing YAML {file_path}: {e}", time.perf_counter() - started
+    return source_tables, None, time.perf_counter() - started
+
+
+def parse_yaml_sources(yaml_contents, max_workers=None):
+    """
+    Parses YAML files, returning the source tables each declares as a list of
+    SourceTable in file order, one list per input file.
+    Files without a `sources:` key are skipped unparsed. Large sets are parsed on a
+    process pool; warnings are logged here, in input order, either way.
+    """
+    results = [[] for _ in yaml_contents]
+    pending = []
+    for index, (file_path, content) in enumerate(yaml_contents):
+        logger.debug("Processing YAML file: %s", file_path)
+        if YAML_SOURCES_KEY.search(content):
+            pending.append(index)
+    if not pending:
+        return results
+
+    paths = [yaml_contents[index][0] for index in pending]
+    contents = [yaml_contents[index][1] for index in pending]
+    max_workers = min(max_workers or YAML_MAX_WORKERS, len(pending))
+    if max_workers <= 1 or sum(len(content) for content in contents) < YAML_PARALLEL_MIN_BYTES:
+        outcomes = map(_load_yaml_source_tables, paths, contents)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=PROCESS_POOL_CONTEXT) as executor:
+            chunksize = max(1, len(pending) // (max_workers * 4))
+            outcomes = list(executor.map(_load_yaml_source_tables, paths, contents, chunksize=chunksize))
+
+    for index, (source_tables, warning, parse_seconds) in zip(pending, outcomes):
+        metrics.observe('yaml_parse_seconds', parse_seconds)
+        if warning:
+            logger.warning(warning)
+        results[index] = source_tables
+    return results
+
+
+def new_reference_provenance():
+    """
+    Per-file record of what each file contributes to the reference map, so the map can be
+    updated incrementally. All values are JSON-serializable for the project store.
+      file_order:    {file_path: seq} position of each file in load order
+      models:        {model_name: [sql file paths defining it]}
+      yaml_tables:   {yml file path: [SourceTable, ...]}
+      source_tables: {table_name: [yml file paths declaring it]}
+    """
+    return {'file_order': {}, 'next_seq': 0, 'models': {}, 'yaml_tables': {}, 'source_tables': {}}
+
+
+def build_reference_map(files_content, provenance=None):
     """
     Builds the dbt reference map. Returns the map.
     Map format: {raw_name: (type, arg1, arg2, file_path)}
+    If a provenance dict (see new_reference_provenance) is passed, it is filled in
+    so the map can later be updated with update_reference_map.
     """
-    # (Keep the implementation from the previous version)
-    # ... (build_reference_map implementation from previous version) ...
     if not files_content:
          return {} # Return empty map if no files
 
@@ -128,100 +1399,397 @@ def build_reference_map(files_content):
 
     # Process Models (.sql files)
     for file_path, content in files_content.items():
-        if file_path.startswith(MODELS_DIR + '/') and file_path.endswith('.sql'):
+        if provenance is not None:
+            provenance['file_order'][file_path] = provenance['next_seq']
+            provenance['next_seq'] += 1
+        if is_model_sql_file(file_path):
             model_name = os.path.splitext(os.path.basename(file_path))[0]
             if model_name in reference_map:
-                print(f"Warning: Duplicate model definition for '{model_name}'. Overwriting.")
+                logger.warning("Duplicate model definition for '%s'. Overwriting.", model_name)
             reference_map[model_name] = ('model', model_name, None, file_path)
-            print(f"  Registered Model: {model_name} (from {file_path})")
+            logger.debug("Registered Model: %s (from %s)", model_name, file_path)
+            if provenance is not None:
+                provenance['models'].setdefault(model_name, []).append(file_path)
         elif file_path.endswith('.yml'):
              yaml_contents.append((file_path, content))
 
-    # Process Sources (.yml files)
-    for file_path, content in yaml_contents:
-        print(f"Processing YAML file: {file_path}")
-        try:
-            data = yaml.safe_load(content)
-            if not isinstance(data, dict): continue
-
-            sources = data.get('sources')
-            if isinstance(sources, list):
-                for source_def in sources:
-                     if not isinstance(source_def, dict): continue
-                     source_name = source_def.get('name')
-                     tables = source_def.get('tables')
-                     if not source_name or not isinstance(tables, list): continue
-
-                     for table_def in tables:
-                         if not isinstance(table_def, dict): continue
-                         table_name = table_def.get('name')
-                         if table_name and isinstance(table_name, str):
-                             if table_name not in reference_map:
-                                 reference_map[table_name] = ('source', source_name, table_name, file_path)
-                                 print(f"  Registered Source: {source_name}.{table_name} (key: {table_name}, from {file_path})")
-                             else:
-                                 if reference_map[table_name][0] == 'model':
-                                      print(f"  Info: Source '{source_name}.{table_name}' conflicts with model '{table_name}'. Prioritizing model.")
-        except yaml.YAMLError as e:
-            print(f"Warning: Error parsing YAML {file_path}: {e}")
-        except Exception as e:
-            print(f"Warning: Unexpected error processing YAML {file_path}: {e}")
+    # Process Sources (.yml files), in file order so precedence and warnings don't depend on parse order
+    for (file_path, _), source_tables in zip(yaml_contents, parse_yaml_sources(yaml_contents)):
+        if provenance is not None:
+            provenance['yaml_tables'][file_path] = source_tables
+            for source_table in source_tables:
+                declared_in = provenance['source_tables'].setdefault(source_table.table_name, [])
+                if file_path not in declared_in:
+                    declared_in.append(file_path)
+
+        for source_name, table_name, *_ in source_tables:
+            if table_name not in reference_map:
+                reference_map[table_name] = ('source', source_name, table_name, file_path)
+                logger.debug("Registered Source: %s.%s (key: %s, from %s)", source_name, table_name, table_name, file_path)
+            else:
+                if reference_map[table_name][0] == 'model':
+                     logger.info("Source '%s.%s' conflicts with model '%s'. Prioritizing model.", source_name, table_name, table_name)
 
     return reference_map
 
 
+def _resolve_reference(provenance, name):
+    """
+    Resolves one name from the provenance with the same precedence as build_reference_map:
+    models beat sources, the last model file in load order wins, the first source declaration wins.
+    Returns the map entry, or None if nothing defines the name.
+    """
+    file_order = provenance['file_order']
+    model_paths = provenance['models'].get(name)
+    yaml_paths = provenance['source_tables'].get(name)
+    if model_paths:
+        file_path = max(model_paths, key=file_order.__getitem__)
+        if yaml_paths:
+            logger.info("Source table '%s' conflicts with model '%s'. Prioritizing model.", name, name)
+        return ('model', name, None, file_path)
+    if yaml_paths:
+        file_path = min(yaml_paths, key=file_order.__getitem__)
+        for source_name, table_name, *_ in provenance['yaml_tables'][file_path]:
+            if table_name == name:
+                return ('source', source_name, table_name, file_path)
+    return None
+
+
+def update_reference_map(reference_map, provenance, changed_files):
+    """
+    Incrementally updates a reference map built by build_reference_map.
+    `changed_files` is {file_path: new_content, or None if the file was deleted}.
+    Only the changed YAML files are re-parsed and only names they (or changed models) touch
+    are re-resolved, so a deleted model falls back to a same-named source if one exists.
+    The result matches a full rebuild over the previous files with the changes applied
+    (modified files keep their position, new files go last).
+    Returns (new_reference_map, new_provenance); the inputs are left untouched.
+    """
+    reference_map = dict(reference_map)
+    provenance = {
+        'file_order': dict(provenance['file_order']),
+        'next_seq': provenance['next_seq'],
+        'models': dict(provenance['models']),
+        'yaml_tables': dict(provenance['yaml_tables']),
+        'source_tables': dict(provenance['source_tables']),
+    }
+    file_order = provenance['file_order']
+    affected_names = set()
+    changed_yaml = [(file_path, content) for file_path, content in changed_files.items()
+                    if file_path.endswith('.yml') and content is not None]
+    parsed_yaml = dict(zip((file_path for file_path, _ in changed_yaml), parse_yaml_sources(changed_yaml)))
+
+    for file_path, content in changed_files.items():
+        is_model = is_model_sql_file(file_path)
+        is_yaml = file_path.endswith('.yml')
+        if not (is_model or is_yaml): continue
+
+        if content is None:
+            file_order.pop(file_path, None)
+        elif file_path not in file_order:
+            file_order[file_path] = provenance['next_seq']
+            provenance['next_seq'] += 1
+
+        if is_model:
+            model_name = os.path.splitext(os.path.basename(file_path))[0]
+            affected_names.add(model_name)
+            model_paths = [p for p in provenance['models'].get(model_name, []) if p != file_path]
+            if content is not None:
+                model_paths.append(file_path)
+            if model_paths:
+                provenance['models'][model_name] = model_paths
+            else:
+                provenance['models'].pop(model_name, None)
+            continue
+
+        for source_table in provenance['yaml_tables'].pop(file_path, []):
+            table_name = source_table.table_name
+            affected_names.add(table_name)
+            yaml_paths = [p for p in provenance['source_tables'].get(table_name, []) if p != file_path]
+            if yaml_paths:
+                provenance['source_tables'][table_name] = yaml_paths
+            else:
+                provenance['source_tables'].pop(table_name, None)
+        if content is not None:
+            source_tables = parsed_yaml[file_path]
+            provenance['yaml_tables'][file_path] = source_tables
+            for source_table in source_tables:
+                table_name = source_table.table_name
+                affected_names.add(table_name)
+                yaml_paths = provenance['source_tables'].get(table_name, [])
+                if file_path not in yaml_paths:
+                    provenance['source_tables'][table_name] = yaml_paths + [file_path]
+
+    for name in affected_names:
+        ref_info = _resolve_reference(provenance, name)
+        if ref_info is None:
+            if reference_map.pop(name, None) is not None:
+                logger.debug("Removed reference: %s", name)
+        elif reference_map.get(name) != ref_info:
+            reference_map[name] = ref_info
+            logger.debug("Updated reference: %s -> %s (from %s)", name, ref_info[0], ref_info[3])
+
+    return reference_map, provenance
+
+
+def _is_static_name(value):
+    # Jinja in a YAML schema/database (e.g. env_var) only resolves at dbt compile time
+    return isinstance(value, str) and bool(value) and '{{' not in value
+
+
+def build_resolution_index(reference_map, provenance=None):
+    """
+    Maps every name a query may use for a model or source to the reference map entries it can mean.
+    Models are indexed by name. Source tables are indexed by table name, source_name.table_name,
+    their identifier, schema.identifier and database.schema.identifier (from the YAML `identifier:`,
+    `schema:` and `database:` keys, with dbt's defaults). Bare names keep the reference map's
+    precedence (models beat sources); any key left with several distinct entries is ambiguous.
+    Without provenance, only the sources recorded in the reference map are indexed.
+    Returns {name: tuple of entries}, so resolving a name is one dict lookup.
+    """
+    if provenance:
+        file_order = provenance['file_order']
+        source_tables = [(file_path, source_table)
+                         for file_path in sorted(provenance['yaml_tables'], key=file_order.__getitem__)
+                         for source_table in provenance['yaml_tables'][file_path]]
+    else:
+        source_tables = [(ref_info[3], SourceTable(ref_info[1], ref_info[2], None, ref_info[1], ref_info[2]))
+                         for ref_info in reference_map.values() if ref_info[0] == 'source']
+
+    index = {}
+    def add(key, ref_info):
+        entries = index.setdefault(key, [])
+        # The same source table declared twice is one target, as in the reference map (first wins)
+        if all(entry[:3] != ref_info[:3] for entry in entries):
+            entries.append(ref_info)
+
+    model_names = set()
+    for name, ref_info in reference_map.items():
+        if ref_info[0] == 'model':
+            model_names.add(name)
+            add(name, ref_info)
+    for file_path, source_table in source_tables:
+        ref_info = ('source', source_table.source_name, source_table.table_name, file_path)
+        identifier = source_table.identifier if _is_static_name(source_table.identifier) else source_table.table_name
+        keys = [source_table.table_name, identifier, f"{source_table.source_name}.{source_table.table_name}"]
+        if _is_static_name(source_table.schema):
+            keys.append(f"{source_table.schema}.{identifier}")
+            if _is_static_name(source_table.database):
+                keys.append(f"{source_table.database}.{source_table.schema}.{identifier}")
+        for key in keys:
+            if key in model_names: continue
+            add(key, ref_info)
+    return {key: tuple(entries) for key, entries in index.items()}
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping with hit/miss counters."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def info(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+                }
+
+
+# Result of one pass over a query: the table names, CTE names and (start, end) offsets
+# of every identifier token, which rewrite_table_references substitutes into
+# tables: bare names of the referenced tables. table_refs: one (name_parts, start, end) per FROM/JOIN
+# reference, e.g. (('raw', 'orders'), 14, 24), with the span covering the whole qualified name.
+SqlExtraction = namedtuple('SqlExtraction', ['tables', 'cte_names', 'identifier_spans', 'table_refs'])
+
+parse_cache = LRUCache(PARSE_CACHE_SIZE)
+
+
 def extract_tables_from_sql(sql):
     """
     Extracts potential table identifiers from FROM/JOIN clauses. Returns a set.
     Handles simple CTEs and aliases.
     """
-    # (Keep the implementation from the previous version)
-    # ... (extract_tables_from_sql implementation from previous version) ...
-    tables = set()
-    parsed = sqlparse.parse(sql)
+    return set(analyze_sql(sql).tables)
+
+
+def analyze_sql(sql):
+    """
+    Parses a query once and returns its SqlExtraction, memoized in an LRU cache keyed by a
+    hash of the query text. Offsets must line up with the exact text, so the text is hashed
+    as-is. Queries over PARSE_CACHE_MAX_QUERY_CHARS are not cached.
+    """
+    cacheable = len(sql) <= PARSE_CACHE_MAX_QUERY_CHARS
+    if cacheable:
+        key = hashlib.blake2b(sql.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+        extraction = parse_cache.get(key)
+        metrics.inc('parse_cache_total', result='miss' if extraction is None else 'hit')
+        if extraction is not None:
+            return extraction
+    started = time.perf_counter()
+    extraction = _fast_extract(sql) if FAST_EXTRACTOR else None
+    path = 'fast'
+    if extraction is None:
+        extraction = _extract_from_parsed(sqlparse.parse(sql))
+        path = 'full'
+    metrics.observe('sql_parse_seconds', time.perf_counter() - started, path=path)
+    if cacheable:
+        parse_cache.put(key, extraction)
+    return extraction
+
+
+# Keywords that open a group in sqlparse's grouping pass; seen at the top level between WITH
+# and the statement's main DML keyword, they could nest that keyword, so the fast path is unsafe.
+# Other plain keywords there are CTE names that happen to be keywords (e.g. 'source'), or AS.
+_GROUPING_KEYWORDS = ('WHERE', 'CASE', 'WHEN', 'END', 'BEGIN', 'DECLARE', 'IF', 'FOR', 'WHILE', 'LOOP', 'VALUES', 'OVER')
+
+
+def _is_fast_path_safe(statement_tokens):
+    """
+    The extractor only depends on sqlparse's grouping in one place: the WITH clause ends at a
+    DML keyword whose parent is the statement itself. Ungrouped tokens all have the statement
+    as parent, so the fast path is only safe when grouping could not have nested that keyword:
+    balanced parentheses, and any WITH being the statement's first token and followed at the
+    top level only by CTE names, plain keywords, commas and parenthesized bodies.
+    """
+    depth = 0
+    first_significant = None
+    with_open = False
+    has_with = False
+    for token in statement_tokens:
+        if token.is_whitespace or token.ttype in T.Comment:
+            continue
+        if first_significant is None:
+            first_significant = token
+        if token.ttype is T.Punctuation and token.value == '(':
+            depth += 1
+            continue
+        if token.ttype is T.Punctuation and token.value == ')':
+            depth -= 1
+            if depth < 0:
+                return False
+            continue
+        if token.is_keyword and token.normalized == 'WITH':
+            has_with = True
+            if depth == 0:
+                if token is not first_significant:
+                    return False
+                with_open = True
+            continue
+        if with_open and depth == 0:
+            if token.is_keyword and token.normalized in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+                with_open = False
+            elif not (token.ttype is T.Name or (token.ttype is T.Punctuation and token.value == ',')
+                      or (token.ttype is T.Keyword and token.normalized not in _GROUPING_KEYWORDS)):
+                return False
+    if has_with and (first_significant is None or first_significant.normalized != 'WITH'):
+        return False # A WITH nested in a subquery, not at the start of the statement
+    return depth == 0
+
+
+def _fast_extract(sql):
+    """
+    Fast path for analyze_sql: runs the same extractor over the lexer's tokens split into
+    statements by sqlparse's own splitter, skipping the grouping pass that dominates parse time.
+    The flattened tokens are identical either way. Returns None (use the full parse) when a
+    statement contains constructs where grouping could change the result.
+    """
+    statements = list(StatementSplitter().process(sql_lexer.tokenize(sql)))
+    for statement in statements:
+        if not _is_fast_path_safe(statement.tokens):
+            return None
+    return _extract_from_parsed(statements)
+
+
+def _extract_from_parsed(parsed):
+    """
+    Single traversal per statement collecting CTE names, table candidates and identifier offsets.
+    Candidates are only filtered against the CTE names at the end, since a CTE declared in a
+    later statement also hides the name in earlier ones.
+    """
     cte_names = set()
+    candidates = [] # (name_parts, start, end)
+    identifier_spans = []
+    offset = 0
 
-    # Identify CTEs
     for stmt in parsed:
-        tokens = list(stmt.flatten())
+        tokens = []
+        token_spans = []
+        for token in stmt.flatten():
+            end = offset + len(token.value)
+            if token.ttype is T.Name:
+                identifier_spans.append((offset, end))
+            if not token.is_whitespace:
+                tokens.append(token)
+                token_spans.append((offset, end))
+            offset = end
+
+        # CTE state
         in_with = False
+        with_done = False
         name_next = False
         paren_level = 0 # Track parenthesis level for CTE definition end
-        for i, token in enumerate(tokens):
-            if token.is_keyword and token.normalized == 'WITH':
-                in_with, name_next = True, True
-                continue
-
-            # Basic check to exit WITH clause processing
-            if in_with and paren_level == 0 and token.is_keyword and token.normalized in ('SELECT', 'INSERT', 'UPDATE', 'DELETE') and isinstance(token.parent, sqlparse.sql.Statement):
-                 in_with, name_next = False, False
-                 break # End of WITH clause definition section
-
-            if in_with and name_next and token.ttype is T.Name:
-                cte_names.add(token.value)
-                name_next = False
-            # Track parenthesis to better detect end of CTE definition
-            if in_with and token.ttype is T.Punctuation:
-                if token.value == '(':
-                    paren_level += 1
-                elif token.value == ')':
-                    paren_level = max(0, paren_level - 1) # Avoid going below 0
-                # If parenthesis level is back to 0 and we see a comma, expect next CTE name
-                elif token.value == ',' and paren_level == 0:
-                    name_next = True
-
-    print(f"  Found CTE names (ignored): {cte_names}")
-
-    # Identify tables
-    for stmt in parsed:
+        # Table state
         from_seen, join_seen, skip_next = False, False, False
-        tokens = [t for t in stmt.flatten() if not t.is_whitespace]
+        resume_at = 0 # Index after the last qualified name consumed as a whole
+
         for i, token in enumerate(tokens):
             val, typ = token.value, token.ttype
             # Use token.normalized safely
             norm = token.normalized if hasattr(token, 'normalized') and token.normalized else None
 
-            # Reset logic
+            # Identify CTEs
+            if not with_done:
+                if token.is_keyword and norm == 'WITH':
+                    in_with, name_next = True, True
+                # Basic check to exit WITH clause processing
+                elif in_with and paren_level == 0 and token.is_keyword and norm in ('SELECT', 'INSERT', 'UPDATE', 'DELETE') and isinstance(token.parent, sqlparse.sql.Statement):
+                    in_with, name_next, with_done = False, False, True # End of WITH clause definition section
+                else:
+                    if in_with and name_next and typ is T.Name:
+                        cte_names.add(val)
+                        name_next = False
+                    # Track parenthesis to better detect end of CTE definition
+                    if in_with and typ is T.Punctuation:
+                        if val == '(':
+                            paren_level += 1
+                        elif val == ')':
+                            paren_level = max(0, paren_level - 1) # Avoid going below 0
+                        # If parenthesis level is back to 0 and we see a comma, expect next CTE name
+                        elif val == ',' and paren_level == 0:
+                            name_next = True
+
+            if i < resume_at:
+                continue
+
+            # Identify tables: reset logic
             if token.is_keyword and norm in ('WHERE', 'GROUP', 'ORDER', 'LIMIT', 'ON', 'USING', 'UNION', 'INTERSECT', 'EXCEPT', 'WINDOW', 'PARTITION', 'FETCH', 'OFFSET'):
                 from_seen, join_seen, skip_next = False, False, False
                 continue
@@ -248,44 +1816,19 @@ def extract_tables_from_sql(sql):
                     skip_next = False
                     continue
 
-                # Use get_name() as a fallback if get_real_name isn't there or fails
-                table_candidate = token.value
-                if hasattr(token, 'get_real_name'):
-                    real_name = token.get_real_name()
-                    if real_name: table_candidate = real_name
-                elif hasattr(token, 'get_name'):
-                     name = token.get_name()
-                     if name: table_candidate = name
-
-                table_candidate = table_candidate.strip('"`\'')
-
-                if not table_candidate: # Skip if empty after stripping quotes
-                     continue
+                # Qualified name check: consume database.schema.table (or schema.table) as one reference
+                last = i
+                name_parts = [val.strip('"`\'')]
+                while last + 2 < len(tokens) and tokens[last+1].value == '.' and tokens[last+2].ttype is T.Name:
+                    last += 2
+                    name_parts.append(tokens[last].value.strip('"`\''))
+                resume_at = last + 1
 
-                if table_candidate in cte_names:
-                    print(f"  Ignoring CTE reference: {table_candidate}")
-                else:
-                    table_name = table_candidate
-                    # Qualified name check
-                    if i + 2 < len(tokens) and tokens[i+1].value == '.' and (tokens[i+2].ttype is T.Name or isinstance(tokens[i+2], sqlparse.sql.Identifier)):
-                        part2_token = tokens[i+2]
-                        part2_name = part2_token.value # Default to value
-                        if hasattr(part2_token, 'get_real_name'):
-                            real_name_p2 = part2_token.get_real_name()
-                            if real_name_p2: part2_name = real_name_p2
-                        elif hasattr(part2_token, 'get_name'):
-                             name_p2 = part2_token.get_name()
-                             if name_p2: part2_name = name_p2
-                        table_name = part2_name.strip('"`\'')
-                        print(f"  Found qualified: {table_candidate}.{table_name} -> using '{table_name}'")
-                    else:
-                        print(f"  Found potential table: {table_name}")
-
-                    if table_name: # Ensure not empty after potential qualification logic
-                        tables.add(table_name)
+                if all(name_parts): # Skip if any part is empty after stripping quotes
+                    candidates.append((tuple(name_parts), token_spans[i][0], token_spans[last][1]))
 
                 # Alias check (simplified)
-                next_idx = i + (3 if (i + 2 < len(tokens) and tokens[i+1].value == '.') else 1)
+                next_idx = last + 1
                 if next_idx < len(tokens):
                     next_t = tokens[next_idx]
                     # If next token is 'AS' keyword, or just a Name/Identifier (not keyword)
@@ -301,93 +1844,885 @@ def extract_tables_from_sql(sql):
                     elif is_alias_name:
                          skip_next = True # Skip the alias name
 
-    return tables
+    logger.debug("Found CTE names (ignored): %s", cte_names)
+
+    tables = set()
+    table_refs = []
+    for name_parts, start, end in candidates:
+        if len(name_parts) == 1 and name_parts[0] in cte_names:
+            logger.debug("Ignoring CTE reference: %s", name_parts[0])
+            continue
+        logger.debug("Found potential table: %s", '.'.join(name_parts))
+        tables.add(name_parts[-1])
+        table_refs.append((name_parts, start, end))
+
+    return SqlExtraction(frozenset(tables), frozenset(cte_names), tuple(identifier_spans), tuple(table_refs))
 
 
-def perform_translation(reference_map, sql_query):
+def _jinja_call_for(ref_info):
+    """Returns the ref()/source() Jinja call for a reference map entry, or None for unknown types."""
+    ref_type, arg1, arg2 = ref_info[0], ref_info[1], ref_info[2]
+    if ref_type == 'model':
+        return f"{{{{ ref('{arg1}') }}}}"
+    if ref_type == 'source':
+        return f"{{{{ source('{arg1}', '{arg2}') }}}}"
+    return None
+
+
+def rewrite_table_references(sql_query, identifier_spans, replacements, qualified_spans=()):
+    """
+    Substitutes every table reference in one scan over the query.
+    `replacements` maps table names to Jinja calls. Bare names are matched case-insensitively as
+    whole words; `qualified_spans` lists (start, end, name) for qualified references such as
+    raw.orders, each replaced as a whole by replacements[name].
+    Only identifier tokens are rewritten, so comments, string literals and text already
+    substituted are never touched. Returns (rewritten_sql, {table_name: replacement_count}).
+    """
+    # Longest names first, so the alternation prefers them, as the per-table loop did
+    sorted_names = sorted((name for name in replacements if '.' not in name), key=len, reverse=True)
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(name) for name in sorted_names) + r')\b', re.IGNORECASE) if sorted_names else None
+    by_lower_name = {}
+    for name in sorted_names:
+        by_lower_name.setdefault(name.lower(), name)
+    counts = dict.fromkeys(replacements, 0)
+
+    def substitute(match):
+        name = by_lower_name[match.group(0).lower()]
+        counts[name] += 1
+        return replacements[name]
+
+    pieces = []
+    last_end = 0
+    qualified_spans = sorted(qualified_spans)
+    next_qualified = 0
+    def replace_qualified_until(position):
+        nonlocal last_end, next_qualified
+        while next_qualified < len(qualified_spans) and qualified_spans[next_qualified][0] <= position:
+            start, end, name = qualified_spans[next_qualified]
+            next_qualified += 1
+            pieces.append(sql_query[last_end:start])
+            pieces.append(replacements[name])
+            counts[name] += 1
+            last_end = end
+
+    for start, end in identifier_spans:
+        replace_qualified_until(start)
+        if pattern is None or start < last_end: continue # Nothing bare to match, or part of a replaced qualified name
+        pieces.append(sql_query[last_end:start])
+        pieces.append(pattern.sub(substitute, sql_query[start:end]))
+        last_end = end
+    replace_qualified_until(len(sql_query))
+    pieces.append(sql_query[last_end:])
+    return ''.join(pieces), counts
+
+
+_fallback_resolution_index = (None, None)
+
+
+def _resolution_index_for(reference_map):
+    """Resolution index for callers that only have a reference map, rebuilt only when the map object changes."""
+    global _fallback_resolution_index
+    indexed_map, resolution_index = _fallback_resolution_index
+    if indexed_map is not reference_map:
+        resolution_index = build_resolution_index(reference_map)
+        _fallback_resolution_index = (reference_map, resolution_index)
+    return resolution_index
+
+
+def resolve_table_name(resolution_index, name_parts):
+    """
+    Resolves a bare or qualified table name to its candidate reference map entries: none if unknown,
+    more than one if ambiguous. A qualified name the index doesn't know falls back to its bare
+    name when that is a model, since a model's schema is set by dbt config, not the project files.
+    """
+    candidates = resolution_index.get('.'.join(name_parts), ())
+    if not candidates and len(name_parts) > 1:
+        bare_candidates = resolution_index.get(name_parts[-1], ())
+        if len(bare_candidates) == 1 and bare_candidates[0][0] == 'model':
+            candidates = bare_candidates
+    return candidates
+
+
+def perform_translation(reference_map, sql_query, resolution_index=None):
     """
     Performs the translation using the provided map and query.
+    Pass the project's resolution index to resolve qualified names against everything the source
+    YAML declares; without it, an index is built from the reference map alone.
     Returns (translated_sql_string, error_message_string_or_None).
     """
-    print("--- Performing Translation ---")
+    translated_sql, error, _ = _perform_translation(reference_map, sql_query, resolution_index)
+    return translated_sql, error
+
+
+def _perform_translation(reference_map, sql_query, resolution_index=None):
+    """perform_translation that also returns the set of unresolved (unknown or ambiguous) table names."""
+    logger.debug("Performing translation")
     if not reference_map:
-        return sql_query, "Reference map is not available or empty. Please load a model first."
+        return sql_query, "Reference map is not available or empty. Please load a model first.", set()
+    if resolution_index is None:
+        resolution_index = _resolution_index_for(reference_map)
 
     try:
-        found_tables = extract_tables_from_sql(sql_query)
+        extraction = analyze_sql(sql_query)
     except Exception as e:
-         print(f"Error parsing SQL during translation: {e}")
-         return sql_query, f"Error parsing the input SQL query: {e}"
+         logger.error("Error parsing SQL during translation: %s", e)
+         metrics.inc('translations_total', result='error')
+         return sql_query, f"Error parsing the input SQL query: {e}", set()
 
-    if not found_tables:
-        print("No table references found in SQL to translate.")
-        return sql_query, None # No error, just nothing to do
+    if not extraction.table_refs:
+        logger.debug("No table references found in SQL to translate.")
+        metrics.inc('translations_total', result='unchanged')
+        return sql_query, None, set() # No error, just nothing to do
 
-    print(f"Tables found for translation attempt: {found_tables}")
+    names = {'.'.join(name_parts): name_parts for name_parts, _, _ in extraction.table_refs}
+    logger.debug("Tables found for translation attempt: %s", names)
 
-    jinja_sql_query = sql_query
+    replacements = {}
     unmatched_tables = set()
-    sorted_tables = sorted(list(found_tables), key=len, reverse=True)
-
-    for table_name in sorted_tables:
-        # Normalize here again just in case parser included quotes inconsistently
-        normalized_table_name = table_name.strip('"`\'')
-        if not normalized_table_name: continue # Skip empty names
-
-        if normalized_table_name in reference_map:
-            ref_info = reference_map[normalized_table_name]
-            ref_type, arg1, arg2 = ref_info[0], ref_info[1], ref_info[2]
-            jinja_call = ""
-            if ref_type == 'model':
-                jinja_call = f"{{{{ ref('{arg1}') }}}}"
-            elif ref_type == 'source':
-                jinja_call = f"{{{{ source('{arg1}', '{arg2}') }}}}"
-            else: continue
-
-            print(f"  Replacing '{normalized_table_name}' with {jinja_call}")
-            # Use the original table_name (potentially with quotes) for regex matching
-            pattern = r'\b' + re.escape(table_name) + r'\b'
-            new_jinja_sql_query, num_replacements = re.subn(pattern, jinja_call, jinja_sql_query, flags=re.IGNORECASE)
-
-            if num_replacements > 0:
-                 jinja_sql_query = new_jinja_sql_query
-                 print(f"    Replaced {num_replacements} instance(s).")
+    ambiguous_tables = {}
+    for table_name, name_parts in names.items():
+        candidates = resolve_table_name(resolution_index, name_parts)
+        if not candidates:
+            unmatched_tables.add(table_name)
+        elif len(candidates) > 1:
+            ambiguous_tables[table_name] = candidates
+        else:
+            jinja_call = _jinja_call_for(candidates[0])
+            if jinja_call is None: continue
+            logger.debug("Replacing '%s' with %s", table_name, jinja_call)
+            replacements[table_name] = jinja_call
+
+    if unmatched_tables or ambiguous_tables:
+        errors = []
+        if unmatched_tables:
+            errors.append(f"Error: The following tables were not found in the loaded dbt project: {', '.join(sorted(unmatched_tables))}")
+        if ambiguous_tables:
+            described = (f"{table_name} could be {' or '.join(_jinja_call_for(candidate) for candidate in candidates)}"
+                         for table_name, candidates in sorted(ambiguous_tables.items()))
+            errors.append(f"Error: The following table names are ambiguous; qualify them with a schema or source name: {'; '.join(described)}")
+        error_message = '\n'.join(errors)
+        logger.info(error_message)
+        metrics.inc('translations_total', result='unmatched')
+        return sql_query, error_message, unmatched_tables | set(ambiguous_tables) # Return original SQL and error
+
+    if not replacements:
+        metrics.inc('translations_total', result='unchanged')
+        return sql_query, None, set()
+
+    qualified_spans = [(start, end, '.'.join(name_parts)) for name_parts, start, end in extraction.table_refs if len(name_parts) > 1]
+    jinja_sql_query, counts = rewrite_table_references(sql_query, extraction.identifier_spans, replacements, qualified_spans)
+    for table_name, num_replacements in counts.items():
+        if num_replacements > 0:
+            logger.debug("Replaced %d instance(s) of '%s'.", num_replacements, table_name)
+        else:
+            logger.warning("No identifier matched '%s'.", table_name)
+
+    metrics.inc('replacements_total', sum(counts.values()))
+    metrics.inc('translations_total', result='success')
+    logger.debug("Translation complete")
+    return jinja_sql_query, None, set()
+
+
+class SqlStatementSplitter:
+    """
+    Incrementally splits SQL text into statements at semicolons outside string literals,
+    dollar-quoted bodies, quoted identifiers and comments (quoting rules follow sqlparse's
+    lexer). Feed text in chunks of any size; only the current, unfinished statement is
+    buffered. The statements returned by feed() and close() concatenate back to exactly the input.
+    """
+
+    # A dollar quote ($$ or $tag$) can't open right after a word character, '"' or '$'
+    _NORMAL = re.compile(r"""[;'"`]|--|/\*|(?<![\w"$])\$(?i:[_A-ZÀ-Ü]\w*)?\$""")
+    _PARTIAL_DOLLAR_QUOTE = re.compile(r'\$\w*\Z')
+    _CLOSERS = {
+        "'": re.compile(r"\\[\s\S]|'"),
+        '"': re.compile(r'\\[\s\S]|"'),
+        '`': re.compile(r'`'),
+        '--': re.compile(r'\n'),
+        '/*': re.compile(r'\*/'),
+    }
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0 # Scan position in the buffer
+        self._mode = None # None outside quotes/comments, else the opening token
+
+    def feed(self, chunk):
+        """Adds text and returns the list of statements it completed."""
+        self._buffer += chunk
+        statements = []
+        start = 0
+        while True:
+            end = self._scan()
+            if end is None:
+                break
+            statements.append(self._buffer[start:end])
+            start = end
+        if start:
+            self._buffer = self._buffer[start:]
+            self._pos -= start
+        return statements
+
+    def close(self):
+        """Returns the trailing text after the last semicolon ('' if none)."""
+        remainder, self._buffer, self._pos, self._mode = self._buffer, '', 0, None
+        return remainder
+
+    def _resume_position(self, partial_tokens):
+        """Where to resume scanning: before a trailing unscanned character that may pair with the next chunk."""
+        end = len(self._buffer)
+        if self._pos < end and self._buffer.endswith(partial_tokens):
+            return end - 1
+        return end
+
+    def _scan(self):
+        """Advances through the buffer; returns the end offset of the next complete statement, or None."""
+        buffer = self._buffer
+        while True:
+            if self._mode is None:
+                match = self._NORMAL.search(buffer, self._pos)
+                if match is None:
+                    # A trailing '-' or '/' may start a comment, and a trailing '$tag' a dollar quote,
+                    # once the next chunk arrives
+                    partial = self._PARTIAL_DOLLAR_QUOTE.search(buffer, self._pos)
+                    self._pos = partial.start() if partial else self._resume_position(('-', '/'))
+                    return None
+                self._pos = match.end()
+                if match.group(0) == ';':
+                    return self._pos
+                self._mode = match.group(0)
             else:
-                 print(f"    Warning: Regex pattern '{pattern}' did not replace '{table_name}'.")
+                closer = self._CLOSERS.get(self._mode)
+                if closer is None: # A dollar quote, closed by the same $tag$
+                    closer = re.compile(re.escape(self._mode))
+                match = closer.search(buffer, self._pos)
+                if match is None:
+                    if self._mode[0] == '$':
+                        # Keep a possibly partial closing tag so it can complete with the next chunk
+                        self._pos = max(self._pos, len(buffer) - len(self._mode) + 1)
+                    else:
+                        # Keep a trailing escape or '*' so it can pair with the next chunk
+                        self._pos = self._resume_position(('\\', '*'))
+                    return None
+                self._pos = match.end()
+                if len(match.group(0)) == 2 and match.group(0)[0] == '\\':
+                    continue # Escaped character inside a quoted string
+                self._mode = None
+
+
+def iter_text_chunks(binary_stream, chunk_size=None):
+    """Reads a binary stream in chunks and yields decoded UTF-8 text, never splitting a character."""
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        data = binary_stream.read(chunk_size)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def translate_sql_stream(reference_map, chunks, resolution_index=None):
+    """
+    Translates SQL arriving as an iterable of text chunks one statement at a time, so memory
+    is bounded by the largest single statement. Yields (translated_statement, error,
+    unmatched_tables) per statement; a statement that can't be fully translated is yielded
+    unchanged with its error, and the yielded statements always concatenate to the whole output.
+    """
+    splitter = SqlStatementSplitter()
+
+    def translate(statement):
+        if not statement.strip():
+            return statement, None, set() # Whitespace between/after statements passes through
+        return _perform_translation(reference_map, statement, resolution_index)
+
+    for chunk in chunks:
+        for statement in splitter.feed(chunk):
+            yield translate(statement)
+    remainder = splitter.close()
+    if remainder:
+        yield translate(remainder)
+
+
+# Reference map and resolution index for batch worker processes, installed once per worker by _init_batch_worker
+_batch_reference_map = None
+_batch_resolution_index = None
+
+
+def _init_batch_worker(reference_map, resolution_index=None):
+    global _batch_reference_map, _batch_resolution_index
+    _batch_reference_map = reference_map
+    _batch_resolution_index = resolution_index
+
+
+def _translate_batch_item(index, name, sql_query=None, file_path=None, reference_map=None, resolution_index=None):
+    """
+    Translates one batch item (inline SQL or a file to read) against the given reference map,
+    or, in a worker process, the one _init_batch_worker installed.
+    """
+    if reference_map is None:
+        reference_map, resolution_index = _batch_reference_map, _batch_resolution_index
+    result = {'index': index, 'name': name}
+    if sql_query is None:
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                sql_query = f.read()
+        except OSError as e:
+            result.update({'success': False, 'error': f"Could not read {file_path}: {e}", 'unmatched_tables': []})
+            return result
+    translated_sql, error, unmatched_tables = _perform_translation(reference_map, sql_query, resolution_index)
+    result.update({
+        'success': error is None,
+        'translated_sql': translated_sql if error is None else None,
+        'error': error,
+        'unmatched_tables': sorted(unmatched_tables),
+        })
+    return result
+
+
+def translate_batch(reference_map, items, max_workers=None, resolution_index=None):
+    """
+    Translates many queries, yielding one result dict per item as it completes (not in input order).
+    `items` is a list of (name, sql_query, file_path) tuples; file_path is read when sql_query is None.
+    Large batches run on a process pool; the reference map and resolution index are sent to each
+    worker once, at startup.
+    """
+    max_workers = max_workers or BATCH_MAX_WORKERS
+    if max_workers <= 1 or len(items) < BATCH_MIN_PARALLEL:
+        # In-process batches are lazy generators that may interleave with other requests' batches,
+        # so the map is passed along rather than installed in the worker globals
+        for index, (name, sql_query, file_path) in enumerate(items):
+            yield _translate_batch_item(index, name, sql_query, file_path, reference_map, resolution_index)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=PROCESS_POOL_CONTEXT,
+                             initializer=_init_batch_worker, initargs=(reference_map, resolution_index)) as executor:
+        futures = [executor.submit(_translate_batch_item, index, name, sql_query, file_path)
+                   for index, (name, sql_query, file_path) in enumerate(items)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def collect_sql_files(paths):
+    """Expands files, directories (searched recursively) and glob patterns into a sorted list of .sql files."""
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, _, file_names in os.walk(path):
+                found.update(os.path.join(dir_path, name) for name in file_names if name.endswith('.sql'))
+        elif glob.has_magic(path):
+            found.update(match for match in glob.glob(path, recursive=True) if os.path.isfile(match))
+        elif os.path.isfile(path):
+            found.add(path)
         else:
-            unmatched_tables.add(normalized_table_name)
-
-    if unmatched_tables:
-        error_message = f"Error: The following tables were not found in the loaded dbt project: {', '.join(sorted(list(unmatched_tables)))}"
-        print(error_message)
-        return sql_query, error_message # Return original SQL and error
-
-    print("--- Translation Complete ---")
-    return jinja_sql_query, None
-
-
-def create_file_tree(files_content):
-    """Converts flat file paths into a nested dictionary for tree view."""
-    tree = {}
-    for path in sorted(files_content.keys()):
-        parts = path.split('/')
-        node = tree
-        for i, part in enumerate(parts):
-            is_last = i == len(parts) - 1
-            if is_last:
-                # Ensure parent node exists
-                if part not in node:
-                     node[part] = {'_type': 'file'} # Mark as file
+            logger.warning("No such file or directory: %s", path)
+    return sorted(found)
+
+
+def create_path_index(file_paths):
+    """Sorted list of file paths; every folder's files form one contiguous run, found by bisection."""
+    return sorted(file_paths)
+
+
+def _folder_end(path_index, prefix, lo, hi):
+    # Paths starting with `prefix` ('.../') sort below the prefix with its '/' bumped to '0'
+    return bisect_left(path_index, prefix[:-1] + '0', lo, hi)
+
+
+def list_tree_level(path_index, path='', offset=0, limit=TREE_PAGE_SIZE):
+    """
+    Lists one folder level from a path index: folders first, then files, each by name.
+    Folders carry the number of files below them. Walking the level costs one bisection
+    per child folder, independent of how many files those folders hold.
+    Returns a dict with the requested page of entries, or None if the folder doesn't exist.
+    """
+    prefix = path.strip('/') + '/' if path.strip('/') else ''
+    lo, hi = 0, len(path_index)
+    if prefix:
+        lo = bisect_left(path_index, prefix)
+        hi = _folder_end(path_index, prefix, lo, hi)
+        if lo == hi:
+            return None
+
+    folders, files = [], []
+    position = lo
+    while position < hi:
+        name, separator, _ = path_index[position][len(prefix):].partition('/')
+        if separator:
+            end = _folder_end(path_index, prefix + name + '/', position, hi)
+            folders.append({'name': name, 'path': prefix + name, 'type': 'folder', 'count': end - position})
+            position = end
+        else:
+            files.append({'name': name, 'path': prefix + name, 'type': 'file'})
+            position += 1
+    # Files come out in name order; folders may not ('a.b/' sorts before 'a/')
+    entries = sorted(folders, key=lambda entry: entry['name']) + files
+    return {
+        'path': prefix.rstrip('/'),
+        'file_count': hi - lo,
+        'total': len(entries),
+        'offset': offset,
+        'entries': entries[offset:offset + limit],
+        }
+
+
+def load_project_incrementally(repo_api_url, commit_sha, cache=None):
+    """
+    Builds the project for `commit_sha` from the latest stored project of the same repository,
+    fetching and re-parsing only the files changed in between.
+    Returns the new project dict, or None if a full load is needed.
+    """
+    previous = project_store.latest(repo_api_url)
+    if not previous or not previous.get('commit_sha') or not previous.get('provenance'):
+        return None
+    changed_files = fetch_github_changed_files(repo_api_url, previous['commit_sha'], commit_sha, cache=cache)
+    if changed_files is None:
+        return None
+
+    logger.info("Updating reference map incrementally (%d changed file(s) since %s)...", len(changed_files), previous['commit_sha'])
+    reference_map, provenance = update_reference_map(previous['reference_map'], previous['provenance'], changed_files)
+    if not provenance['file_order']:
+        return None # Nothing relevant left; let the full load report it
+    return {
+        'repo_url': repo_api_url,
+        'commit_sha': commit_sha,
+        'reference_map': reference_map,
+        'resolution_index': build_resolution_index(reference_map, provenance),
+        'file_paths': create_path_index(provenance['file_order']),
+        'provenance': provenance,
+        }
+
+def build_project(repo_url, commit_sha, files_content):
+    """Builds the stored project dict (reference map, path index, provenance) from fetched files."""
+    logger.info("Building reference map...")
+    provenance = new_reference_provenance()
+    with timed_stage('build_reference_map'):
+        reference_map = build_reference_map(files_content, provenance)
+    if not reference_map: # build_reference_map now returns {} if files_content was valid but no refs found
+         logger.warning("No models or sources found in the fetched files.")
+         # Proceed, but map will be empty
+
+    logger.info("Creating path index...")
+    with timed_stage('create_path_index'):
+        file_paths = create_path_index(files_content)
+    return {
+        'repo_url': repo_url,
+        'commit_sha': commit_sha,
+        'reference_map': reference_map,
+        'resolution_index': build_resolution_index(reference_map, provenance),
+        'file_paths': file_paths,
+        'provenance': provenance,
+        }
+
+# --- Project Index ---
+
+def write_project_index(project, project_id, index_path):
+    """
+    Writes a project as a versioned, gzip-compressed JSON index file. The file holds the
+    reference map, path index and provenance (the per-name model and source lookup tables),
+    so loading it skips fetching and parsing entirely.
+    """
+    index = {
+        'format': PROJECT_INDEX_FORMAT,
+        'version': PROJECT_INDEX_VERSION,
+        'project_id': project_id,
+        'built_at': time.time(),
+        'project': project_to_json(project),
+    }
+    directory = os.path.dirname(index_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp_path, index_path)
+
+
+def read_project_index(index_path):
+    """
+    Reads an index written by write_project_index. Returns (project_id, project).
+    Raises ValueError for files of another format or version.
+    """
+    with gzip.open(index_path, 'rt', encoding='utf-8') as f:
+        index = json.load(f)
+    if not isinstance(index, dict) or index.get('format') != PROJECT_INDEX_FORMAT:
+        raise ValueError(f"{index_path} is not a project index.")
+    if index.get('version') != PROJECT_INDEX_VERSION:
+        raise ValueError(f"{index_path} has index version {index.get('version')}; expected {PROJECT_INDEX_VERSION}. Rebuild it.")
+    return index['project_id'], project_from_json(index['project'])
+
+
+def load_project_indexes(index_dir):
+    """
+    Puts every readable index in index_dir into the project store, skipping projects already
+    stored. Returns the number loaded. An index never replaces a repository's latest project,
+    which may be a newer commit loaded since the index was built.
+    """
+    loaded = 0
+    for index_path in sorted(glob.glob(os.path.join(index_dir, '*' + PROJECT_INDEX_SUFFIX))):
+        try:
+            project_id, project = read_project_index(index_path)
+        except (OSError, ValueError, KeyError, EOFError) as e:
+            logger.warning("Skipping project index %s: %s", index_path, e)
+            continue
+        if project_store.contains(project_id):
+            continue
+        project_store.put(project_id, project, replace_latest=False)
+        loaded += 1
+        logger.info("Loaded project index %s (%d models/sources).", index_path, len(project['reference_map']))
+    return loaded
+
+
+_project_indexes_loaded = False
+_project_indexes_lock = threading.Lock()
+
+
+def load_startup_project_indexes():
+    """
+    Loads PROJECT_INDEX_DIR into the project store once per server process. This runs before
+    the first request rather than at import, so pool worker processes importing this module
+    don't each reload every index.
+    """
+    global _project_indexes_loaded
+    if _project_indexes_loaded:
+        return
+    with _project_indexes_lock:
+        if not _project_indexes_loaded:
+            if PROJECT_INDEX_DIR:
+                load_project_indexes(PROJECT_INDEX_DIR)
+            _project_indexes_loaded = True
+
+# --- Load Jobs ---
+
+class LoadJob:
+    """
+    One project load running in the background. The job is also the `progress` object the
+    fetchers report to: every change bumps `version` and wakes wait_for_change, which is what
+    /load_jobs/<id>/events streams from. Once all YAML sources are in, `project` holds a partial
+    project (every model and source name, SQL still downloading) that /translate can already use.
+    Changes are also published to the project store (progress at most every
+    LOAD_JOB_PUBLISH_INTERVAL), which is how other workers see the job.
+    """
+
+    def __init__(self, key, repo_url, commit_sha, ingest_mode=None, local_root=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.repo_url = repo_url
+        self.commit_sha = commit_sha
+        self.ingest_mode = ingest_mode
+        self.local_root = local_root
+        self.state = 'queued' # -> running -> done | failed
+        self.stage = None
+        self.directories_listed = 0
+        self.files_fetched = 0
+        self.bytes_fetched = 0
+        self.project = None
+        self.project_id = None
+        self.result = None # The /load_model response body, once done
+        self.error = None
+        self.status_code = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.version = 0
+        self._condition = threading.Condition()
+        self._published_at = 0
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed')
+
+    def _update(self, **changes):
+        with self._condition:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._condition.notify_all()
+        self.publish()
+
+    def publish(self, throttled=False):
+        """Writes this job's record to the project store; with throttled=True, only if the last write is old enough."""
+        now = time.monotonic()
+        if throttled and now - self._published_at < LOAD_JOB_PUBLISH_INTERVAL:
+            return
+        self._published_at = now
+        try:
+            project_store.put_job(self.record())
+        except sqlite3.Error as e:
+            logger.warning("Could not publish load job %s: %s", self.id, e)
+
+    def set_stage(self, stage):
+        self._update(state='running', stage=stage)
+
+    def directory_listed(self, path):
+        with self._condition:
+            self.directories_listed += 1
+            self.version += 1
+            self._condition.notify_all()
+        self.publish(throttled=True)
+
+    def file_fetched(self, path, size):
+        with self._condition:
+            self.files_fetched += 1
+            self.bytes_fetched += size
+            self.version += 1
+            self._condition.notify_all()
+        self.publish(throttled=True)
+
+    def sources_ready(self, files_content):
+        """Publishes a partial project built from every known path and every YAML file."""
+        with timed_stage('build_partial_project'):
+            project = build_project(self.repo_url, self.commit_sha, files_content)
+        project['partial'] = True
+        logger.info("Load job %s: sources ready, %d models/sources available before all files are in.", self.id, len(project['reference_map']))
+        self._update(project=project)
+
+    def finish(self, project_id, project, result):
+        metrics.inc('load_jobs_total', result='done')
+        self._update(state='done', stage=None, project_id=project_id, project=project, result=result, finished_at=time.time())
+
+    def fail(self, error, status_code=500):
+        metrics.inc('load_jobs_total', result='failed')
+        self._update(state='failed', stage=None, project=None, error=error, status_code=status_code, finished_at=time.time())
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                'job_id': self.id,
+                'state': self.state,
+                'stage': self.stage,
+                'repo_url': self.repo_url,
+                'commit_sha': self.commit_sha,
+                'directories_listed': self.directories_listed,
+                'files_fetched': self.files_fetched,
+                'bytes_fetched': self.bytes_fetched,
+                'partial': self.project is not None and self.project.get('partial', False),
+                'error': self.error,
+                }
+
+    def record(self):
+        """The snapshot plus what another worker needs to follow or join this job (see StoredLoadJob)."""
+        with self._condition:
+            return dict(self.snapshot(), key=self.key, project_id=self.project_id, status_code=self.status_code, version=self.version)
+
+    def wait_for_change(self, version, timeout=None):
+        """Waits until the job differs from `version`. Returns (version, snapshot), or (version, None) on timeout."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.version != version, timeout):
+                return version, None
+            version = self.version
+        return version, self.snapshot()
+
+    def wait(self, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(lambda: self.finished, timeout)
+
+
+class StoredLoadJob:
+    """
+    A load job running in another worker, seen through the record it publishes to the project
+    store. Offers what the routes read from a LoadJob; waiting polls the store. A queued or
+    running job whose record has gone stale is reported as failed.
+    """
+
+    def __init__(self, record):
+        self.id = record['job_id']
+        self.project = None # Partial projects stay in the worker running the job
+        self._result = None
+        self._set_record(record)
+
+    @property
+    def state(self):
+        return self._record['state']
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed')
+
+    @property
+    def error(self):
+        return self._record.get('error')
+
+    @property
+    def status_code(self):
+        return self._record.get('status_code')
+
+    @property
+    def project_id(self):
+        return self._record.get('project_id')
+
+    @property
+    def result(self):
+        if self._result is None:
+            self._result = load_result(project_store.get(self.project_id))
+        return self._result
+
+    def refresh(self):
+        self._set_record(project_store.get_job(self.id) or self._record)
+
+    def _set_record(self, record):
+        if record['state'] in ('queued', 'running') and record['updated_at'] < time.time() - LOAD_JOB_STALE_AFTER:
+            record = dict(record, state='failed', stage=None, partial=False, status_code=500,
+                          error='The worker running this load stopped responding. Please load the model again.',
+                          version=record['version'] + 1)
+        elif record['state'] == 'done' and not project_store.contains(record['project_id']):
+            record = dict(record, state='failed', status_code=410, error='The loaded project is no longer stored. Please load the model again.',
+                          version=record['version'] + 1)
+        self._record = record
+
+    def snapshot(self):
+        return {name: value for name, value in self._record.items() if name not in ('key', 'project_id', 'status_code', 'version', 'updated_at')}
+
+    def wait_for_change(self, version, timeout=None):
+        """Polls until the job differs from `version`. Returns (version, snapshot), or (version, None) on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.refresh()
+            if self._record['version'] != version:
+                return self._record['version'], self.snapshot()
+            if deadline is not None and time.monotonic() >= deadline:
+                return version, None
+            time.sleep(LOAD_JOB_EVENT_INTERVAL)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.finished:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(LOAD_JOB_EVENT_INTERVAL)
+            self.refresh()
+        return True
+
+
+class LoadJobQueue:
+    """
+    Runs load jobs on a small thread pool. A load of a project that is already being loaded,
+    here or (with a shared project store) in another worker, joins that job instead of starting
+    another. Finished jobs stay listed for `ttl` seconds so clients can still read how they ended.
+    A heartbeat thread republishes queued and running jobs so other workers know they are alive.
+    """
+
+    def __init__(self, max_workers, ttl):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='load-job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = {} # job key -> queued or running job
+        self._heartbeat = None
+
+    def submit(self, job):
+        """Queues `job`, or returns the active job with the same key. Returns (job, joined)."""
+        with self._lock:
+            now = time.time()
+            for expired in [job_id for job_id, other in self._jobs.items()
+                            if other.finished and now - other.finished_at > self.ttl]:
+                del self._jobs[expired]
+            active = self._active.get(job.key)
+            if active is None:
+                # Claimed under the queue lock, so this worker never races itself for the key
+                record = project_store.claim_job(job.record())
+                active = StoredLoadJob(record) if record else None
+            if active is not None:
+                metrics.inc('load_jobs_total', result='joined')
+                return active, True
+            self._jobs[job.id] = job
+            self._active[job.key] = job
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._publish_active_jobs, name='load-job-heartbeat', daemon=True)
+                self._heartbeat.start()
+        metrics.inc('load_jobs_total', result='started')
+        self._executor.submit(self._run, job)
+        return job, False
+
+    def get(self, job_id):
+        """Returns the job with this id, from this worker or, as a StoredLoadJob, from the project store."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        record = project_store.get_job(job_id)
+        if record is None:
+            return None
+        return StoredLoadJob(record)
+
+    def _publish_active_jobs(self):
+        while True:
+            time.sleep(LOAD_JOB_HEARTBEAT)
+            with self._lock:
+                active = list(self._active.values())
+            for job in active:
+                job.publish()
+
+    def _run(self, job):
+        try:
+            run_project_load(job)
+        except Exception:
+            logger.exception("Load job %s failed.", job.id)
+            job.fail('Unexpected error while loading the project.')
+        finally:
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+
+
+def run_project_load(job):
+    """
+    Loads the project a job describes: incrementally from the last stored commit when possible,
+    otherwise by fetching and parsing every relevant file. Stores the result and finishes the job.
+    """
+    repo_api_url, commit_sha, local_root = job.repo_url, job.commit_sha, job.local_root
+    # Local reads run at disk speed, so they skip the content cache and incremental updates
+    cache = None if local_root else ContentCache.for_repo(repo_api_url)
+    project = None
+    if commit_sha and not local_root:
+        job.set_stage('incremental_update')
+        with timed_stage('incremental_update'):
+            project = load_project_incrementally(repo_api_url, commit_sha, cache)
+    if project is not None:
+        project_id = make_project_id(repo_api_url, commit_sha)
+    else:
+        job.set_stage('fetch')
+        with timed_stage('fetch'):
+            if local_root and commit_sha:
+                files_content = read_git_project_files(local_root, commit_sha, progress=job)
+            elif local_root:
+                files_content = read_local_project_files(local_root, progress=job)
             else:
-                # Ensure parent node exists and mark as folder
-                if part not in node:
-                    node[part] = {'_type': 'folder', 'children': {}}
-                elif '_type' not in node[part]: # Ensure existing nodes are marked
-                     node[part]['_type'] = 'folder'
-                     if 'children' not in node[part]: node[part]['children'] = {}
+                files_content = fetch_dbt_project_files(repo_api_url, job.ingest_mode, cache, progress=job, commit_sha=commit_sha)
+
+        if files_content is None:
+            job.fail('Failed to fetch repository files. Check URL, permissions, or network connection.', 500)
+            return
+        if not files_content:
+            job.fail('No relevant dbt files (.sql in models/, .yml) found in the repository.', 404)
+            return
 
-                node = node[part]['children'] # Move deeper into the tree
-    return tree
+        job.set_stage('build')
+        project = build_project(repo_api_url, commit_sha, files_content)
+        project_id = make_project_id(repo_api_url, commit_sha or digest_files_content(files_content))
+
+    # Store map and path index server-side; sessions only carry the project handle
+    project_store.put(project_id, project)
+    logger.info("Model loaded successfully (load job %s).", job.id)
+    job.finish(project_id, project, load_result(project, cache))
+
+
+def load_result(project, cache=None):
+    """The /load_model response body for a loaded project."""
+    return {
+        'success': True,
+        'message': f"Successfully loaded {len(project['reference_map'])} models/sources.",
+        'file_count': len(project['file_paths']),
+        'tree': list_tree_level(project['file_paths']), # First page of the top level; /tree serves the rest on demand
+        'commit_sha': project.get('commit_sha'),
+        'cache': cache.stats if cache else None
+        }
+
+
+load_jobs = LoadJobQueue(LOAD_JOB_WORKERS, LOAD_JOB_TTL)
 
 # --- Flask Routes ---
 
@@ -395,50 +2730,178 @@ def create_file_tree(files_content):
 def index():
     """Renders the main page."""
     # Clear session on new page load if desired
-    # session.pop('reference_map', None)
-    # session.pop('file_tree', None)
+    # session.pop('project_id', None)
     return render_template('index_ajax.html') # Use a new template name
 
+def get_session_project():
+    """
+    The project this session translates against: its stored project or, while a load is running
+    in this process, whatever that load job has produced so far (a partial project once the
+    sources are in).
+    """
+    project = project_store.get(session.get('project_id'))
+    if project is not None:
+        return project
+    job = load_jobs.get(session.get('load_job_id'))
+    if job is None:
+        return None
+    if job.state == 'done':
+        session['project_id'] = job.project_id
+        session.pop('load_job_id', None)
+    return job.project
+
+
+def finished_load_job_response(job):
+    """The /load_model response body and status for a finished job; a successful load becomes the session's project."""
+    if job.state == 'failed':
+        return {'success': False, 'error': job.error}, job.status_code
+    session['project_id'] = job.project_id
+    session.pop('load_job_id', None)
+    return job.result, 200
+
+
 @app.route('/load_model', methods=['POST'])
 def load_model():
-    """Loads dbt model from GitHub URL via AJAX."""
+    """
+    Loads dbt model from GitHub URL via AJAX. When LOCAL_PROJECT_ROOTS is set, the URL may also
+    be a local directory (or file:// URL) under one of those roots, optionally read at a git `ref`.
+    Projects already in the store are returned at once. Otherwise the load runs as a background
+    job (shared with anyone loading the same project) and the response is 202 with the job's
+    status and event-stream URLs; pass "wait": true to block until it finishes instead.
+    """
     github_url = request.json.get('github_url')
     if not github_url:
         return jsonify({'success': False, 'error': 'GitHub URL is required.'}), 400
 
-    repo_api_url = get_github_api_url(github_url)
-    if not repo_api_url:
-        return jsonify({'success': False, 'error': 'Invalid GitHub repository URL format.'}), 400
+    local_root = resolve_local_project_root(github_url)
+    ref = request.json.get('ref') or None
+    if local_root:
+        repo_api_url = local_repo_url(local_root)
+        logger.info("Attempting to load model from local directory: %s (ref: %s)", local_root, ref or 'working tree')
+        ingest_mode = None
+        commit_sha = None
+        if ref or is_bare_git_repo(local_root):
+            commit_sha = resolve_git_ref(local_root, ref or 'HEAD')
+            if not commit_sha:
+                return jsonify({'success': False, 'error': f"Could not resolve ref '{ref or 'HEAD'}' in the local repository."}), 400
+    else:
+        repo_api_url = get_github_api_url(github_url)
+        if not repo_api_url:
+            return jsonify({'success': False, 'error': 'Invalid GitHub repository URL format.'}), 400
+
+        ingest_mode = request.json.get('ingest_mode') or DEFAULT_INGEST_MODE
+        if ingest_mode not in INGEST_MODES:
+            return jsonify({'success': False, 'error': f"Invalid ingest mode. Expected one of: {', '.join(INGEST_MODES)}."}), 400
+
+        logger.info("Attempting to load model from: %s (ingest mode: %s)", github_url, ingest_mode)
+        commit_sha = get_github_head_sha(repo_api_url)
+    if commit_sha:
+        project_id = make_project_id(repo_api_url, commit_sha)
+        project = project_store.get(project_id)
+        if project is not None:
+            # Someone already loaded this repository at this commit; share their copy
+            logger.info("Reusing loaded project %s (%s).", project_id, commit_sha)
+            session['project_id'] = project_id
+            return jsonify(load_result(project))
+
+    # Loads of the same repository at the same commit (or both at an unresolved head) share one job
+    job_key = make_project_id(repo_api_url, commit_sha or f"unresolved:{ingest_mode}")
+    job, joined = load_jobs.submit(LoadJob(job_key, repo_api_url, commit_sha, ingest_mode, local_root))
+    logger.info("%s load job %s for %s.", 'Joined' if joined else 'Started', job.id, repo_api_url)
+    # A known commit gives the final project id up front, so every worker finds the project once
+    # it is stored; until then the worker running the job serves the partial map
+    if commit_sha:
+        session['project_id'] = make_project_id(repo_api_url, commit_sha)
+    else:
+        session.pop('project_id', None)
+    session['load_job_id'] = job.id
 
-    print(f"Attempting to load model from: {github_url}")
-    files_content = fetch_github_repo_files(repo_api_url)
+    if request.json.get('wait'):
+        job.wait()
+        body, status = finished_load_job_response(job)
+        return jsonify(body), status
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'joined': joined,
+        'status_url': url_for('load_job_status', job_id=job.id),
+        'events_url': url_for('load_job_events', job_id=job.id),
+        'job': job.snapshot()
+        }), 202
 
-    if files_content is None:
-        return jsonify({'success': False, 'error': 'Failed to fetch repository files. Check URL, permissions, or network connection.'}), 500
-    if not files_content:
-         return jsonify({'success': False, 'error': 'No relevant dbt files (.sql in models/, .yml) found in the repository.'}), 404 # Not Found might be appropriate
 
-    print("Building reference map...")
-    reference_map = build_reference_map(files_content)
-    if not reference_map: # build_reference_map now returns {} if files_content was valid but no refs found
-         print("Warning: No models or sources found in the fetched files.")
-         # Proceed, but map will be empty
+def stored_project_for_job(job_id):
+    """
+    The session's stored project if job_id is the session's load job, for when the job's record
+    has expired or was never published (stored projects outlive job records).
+    """
+    if job_id != session.get('load_job_id'):
+        return None
+    return project_store.get(session.get('project_id'))
+
+
+@app.route('/load_jobs/<job_id>', methods=['GET'])
+def load_job_status(job_id):
+    """Reports a load job's progress; once it is done, also its /load_model response."""
+    job = load_jobs.get(job_id)
+    if job is None:
+        project = stored_project_for_job(job_id)
+        if project is None:
+            return jsonify({'success': False, 'error': 'Load job not found.'}), 404
+        return jsonify({**load_result(project), 'job': {'job_id': job_id, 'state': 'done', 'partial': False}})
+    if job.finished:
+        body, status = finished_load_job_response(job)
+        return jsonify({**body, 'job': job.snapshot()}), status
+    return jsonify({'success': True, 'job': job.snapshot()})
+
+
+@app.route('/load_jobs/<job_id>/events', methods=['GET'])
+def load_job_events(job_id):
+    """
+    Streams a load job's progress as server-sent events: a `progress` event whenever it changes
+    (coalesced to one per LOAD_JOB_EVENT_INTERVAL), then a final `done` or `failed` event.
+    """
+    job = load_jobs.get(job_id)
+    if job is None:
+        if stored_project_for_job(job_id) is None:
+            return jsonify({'success': False, 'error': 'Load job not found.'}), 404
+        done = json.dumps({'job_id': job_id, 'state': 'done', 'partial': False})
+        return Response(f"event: done\ndata: {done}\n\n", mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    def generate():
+        version = -1
+        while True:
+            version, snapshot = job.wait_for_change(version, LOAD_JOB_HEARTBEAT)
+            if snapshot is None:
+                yield ': keep-alive\n\n'
+                continue
+            event = snapshot['state'] if snapshot['state'] in ('done', 'failed') else 'progress'
+            yield f"event: {event}\ndata: {json.dumps(snapshot)}\n\n"
+            if event != 'progress':
+                return
+            time.sleep(LOAD_JOB_EVENT_INTERVAL)
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-    print("Creating file tree...")
-    file_tree = create_file_tree(files_content)
 
-    # Store map and tree in session for later use by /translate
-    session['reference_map'] = reference_map
-    # Storing the full tree might exceed session size limits for large repos
-    # Consider storing only file paths list if tree generation is fast on client
-    session['file_tree'] = file_tree # Storing for simplicity in POC
+@app.route('/tree', methods=['GET'])
+def tree():
+    """
+    Lists one folder of the loaded project's file tree, a page at a time.
+    Query parameters: path (folder, '' for the top level), offset, limit.
+    """
+    project = get_session_project()
+    if project is None:
+        return jsonify({'success': False, 'error': 'Model not loaded. Please load a model first.'}), 400
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(max(1, int(request.args.get('limit', TREE_PAGE_SIZE))), TREE_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset and limit must be integers.'}), 400
 
-    print("Model loaded successfully.")
-    return jsonify({
-        'success': True,
-        'message': f'Successfully loaded {len(reference_map)} models/sources.',
-        'file_tree': file_tree # Send tree structure to client
-        })
+    level = list_tree_level(project['file_paths'], request.args.get('path', ''), offset, limit)
+    if level is None:
+        return jsonify({'success': False, 'error': 'Folder not found.'}), 404
+    return jsonify({'success': True, **level})
 
 
 @app.route('/translate', methods=['POST'])
@@ -448,12 +2911,14 @@ def translate_ajax():
     if not sql_query:
         return jsonify({'success': False, 'error': 'SQL query is required.'}), 400
 
-    # Retrieve reference map from session
-    reference_map = session.get('reference_map')
-    if reference_map is None: # Check if None explicitly, {} is valid (empty map)
+    # Retrieve the loaded (or, mid-load, partially loaded) project via the handles stored in the session
+    project = get_session_project()
+    if project is None:
         return jsonify({'success': False, 'error': 'Model not loaded. Please load a model first.'}), 400
+    reference_map = project['reference_map']
 
-    translated_sql, error = perform_translation(reference_map, sql_query)
+    with timed_stage('translate'):
+        translated_sql, error = perform_translation(reference_map, sql_query, project['resolution_index'])
 
     if error:
         return jsonify({'success': False, 'error': error}) # Send error back
@@ -461,6 +2926,210 @@ def translate_ajax():
         return jsonify({'success': True, 'translated_sql': translated_sql}) # Send result
 
 
+@app.route('/translate_batch', methods=['POST'])
+def translate_batch_ajax():
+    """
+    Translates many queries at once. Accepts a JSON array, or {"queries": [...]}, where each
+    item is a SQL string or {"name": ..., "sql_query": ...}. Streams one NDJSON line per
+    query as it completes.
+    """
+    payload = request.json
+    queries = payload if isinstance(payload, list) else (payload or {}).get('queries')
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'success': False, 'error': 'A non-empty list of SQL queries is required.'}), 400
+
+    project = get_session_project()
+    if project is None:
+        return jsonify({'success': False, 'error': 'Model not loaded. Please load a model first.'}), 400
+
+    items = []
+    for index, query in enumerate(queries):
+        if isinstance(query, dict):
+            name, sql_query = query.get('name', str(index)), query.get('sql_query')
+        else:
+            name, sql_query = str(index), query
+        if not isinstance(sql_query, str):
+            return jsonify({'success': False, 'error': f'Query {index} has no SQL text.'}), 400
+        items.append((name, sql_query, None))
+
+    reference_map, resolution_index = project['reference_map'], project['resolution_index']
+    def generate():
+        for result in translate_batch(reference_map, items, resolution_index=resolution_index):
+            yield json.dumps(result) + '\n'
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/translate_stream', methods=['POST'])
+def translate_stream():
+    """
+    Translates a large SQL script sent as the raw request body, statement by statement.
+    Streams one NDJSON line per statement, then a summary line with all unmatched tables.
+    """
+    project = get_session_project()
+    if project is None:
+        return jsonify({'success': False, 'error': 'Model not loaded. Please load a model first.'}), 400
+    reference_map, resolution_index = project['reference_map'], project['resolution_index']
+
+    def generate():
+        all_unmatched = set()
+        count = 0
+        for index, (translated_sql, error, unmatched_tables) in enumerate(translate_sql_stream(reference_map, iter_text_chunks(request.stream), resolution_index)):
+            all_unmatched.update(unmatched_tables)
+            count = index + 1
+            yield json.dumps({'index': index, 'translated_sql': translated_sql, 'error': error, 'unmatched_tables': sorted(unmatched_tables)}) + '\n'
+        yield json.dumps({'done': True, 'statements': count, 'success': not all_unmatched, 'unmatched_tables': sorted(all_unmatched)}) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/parse_cache', methods=['GET'])
+def parse_cache_stats():
+    """Reports the size and hit rate of the parse-result cache."""
+    return jsonify(parse_cache.info())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Exposes counters and timings in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.before_request
+def load_indexes_before_first_request():
+    load_startup_project_indexes()
+
+
+@app.after_request
+def record_request_timing(response):
+    """Records the request duration and, if TIMING_HEADERS is set, adds a Server-Timing header."""
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    metrics.observe('request_seconds', elapsed, endpoint=request.endpoint or 'unknown')
+    if TIMING_HEADERS:
+        timings = [f'{stage};dur={duration * 1000:.1f}' for stage, duration in g.get('stage_timings', [])]
+        timings.append(f'total;dur={elapsed * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+
+# --- CLI Commands ---
+
+@app.cli.command('translate-batch')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--github-url', help='dbt project repository to translate against.')
+@click.option('--index', 'index_path', type=click.Path(exists=True, dir_okay=False), help='Prebuilt project index to translate against (see build-index).')
+@click.option('--output-dir', type=click.Path(file_okay=False), help='Write translated files here instead of only reporting them.')
+@click.option('--workers', type=int, default=None, help='Number of worker processes.')
+def translate_batch_command(paths, github_url, index_path, output_dir, workers):
+    """Translates .sql files (files, directories or globs), writing NDJSON results to stdout."""
+    out = sys.stdout
+    if bool(github_url) == bool(index_path):
+        raise click.UsageError('Pass exactly one of --github-url or --index.')
+    if index_path:
+        try:
+            project = read_project_index(index_path)[1]
+        except (OSError, ValueError, KeyError, EOFError) as e:
+            raise click.ClickException(f'Could not read project index: {e}')
+    else:
+        repo_api_url = get_github_api_url(github_url)
+        if not repo_api_url:
+            raise click.UsageError('Invalid GitHub repository URL format.')
+        files_content = fetch_dbt_project_files(repo_api_url, cache=ContentCache.for_repo(repo_api_url))
+        if files_content is None:
+            raise click.ClickException('Failed to fetch repository files.')
+        project = build_project(repo_api_url, None, files_content)
+
+    file_paths = collect_sql_files(paths)
+    if not file_paths:
+        raise click.ClickException('No .sql files found.')
+    base_dir = os.path.commonpath([os.path.dirname(os.path.abspath(file_path)) for file_path in file_paths])
+    items = [(file_path, None, file_path) for file_path in file_paths]
+    failed = 0
+    for result in translate_batch(project['reference_map'], items, workers, project['resolution_index']):
+        if not result['success']:
+            failed += 1
+        elif output_dir:
+            target = os.path.join(output_dir, os.path.relpath(os.path.abspath(result['name']), base_dir))
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            with open(target, 'w', encoding='utf-8') as f:
+                f.write(result['translated_sql'])
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+    logger.info("Translated %d of %d file(s).", len(items) - failed, len(items))
+
+
+@app.cli.command('build-index')
+@click.argument('source')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help=f'Index file to write. Defaults to <project id>{PROJECT_INDEX_SUFFIX} in the current directory.')
+@click.option('--github-url', help='Repository the index is served for, when SOURCE is a local checkout.')
+@click.option('--ref', help='Read a local git repository (bare or not) at this ref. Defaults to HEAD, or to the working tree (which must be clean) when --commit-sha is given.')
+@click.option('--commit-sha', help='Commit the index is for. Defaults to the ref\'s commit, the checkout\'s HEAD or the repository\'s head commit.')
+@click.option('--ingest-mode', type=click.Choice(INGEST_MODES), default=None, help='How to fetch SOURCE when it is a GitHub URL.')
+def build_index_command(source, output, github_url, ref, commit_sha, ingest_mode):
+    """
+    Builds a project index from SOURCE, a local dbt checkout, a git repository or a GitHub URL.
+    Put indexes in PROJECT_INDEX_DIR so /load_model serves the matching repository and commit
+    without fetching.
+    """
+    if os.path.isdir(source):
+        repo_api_url = get_github_api_url(github_url) if github_url else local_repo_url(source)
+        if not repo_api_url:
+            raise click.UsageError('Invalid GitHub repository URL format.')
+        if not ref and not commit_sha and resolve_git_ref(source, 'HEAD'):
+            # The index is labelled with HEAD's commit, so read that commit rather than the working tree
+            ref = 'HEAD'
+        elif not ref and commit_sha and has_uncommitted_changes(source):
+            raise click.ClickException(f"{source} has uncommitted changes; commit them or pass --ref to index a commit.")
+        files_content, ref_sha = read_local_project(source, ref)
+        if files_content is None:
+            raise click.ClickException(f"Could not read {source} at '{ref}'.")
+        commit_sha = commit_sha or ref_sha
+    else:
+        repo_api_url = get_github_api_url(source)
+        if not repo_api_url:
+            raise click.UsageError('SOURCE must be a directory or a GitHub repository URL.')
+        commit_sha = commit_sha or get_github_head_sha(repo_api_url)
+        files_content = fetch_dbt_project_files(repo_api_url, ingest_mode, ContentCache.for_repo(repo_api_url), commit_sha=commit_sha)
+        if files_content is None:
+            raise click.ClickException('Failed to fetch repository files.')
+    if not files_content:
+        raise click.ClickException('No relevant dbt files (.sql in models/, .yml) found.')
+
+    project = build_project(repo_api_url, commit_sha, files_content)
+    project_id = make_project_id(repo_api_url, commit_sha or digest_files_content(files_content))
+    output = output or project_id + PROJECT_INDEX_SUFFIX
+    write_project_index(project, project_id, output)
+    click.echo(f"Wrote {output}: {len(project['reference_map'])} models/sources from {len(files_content)} file(s) at {commit_sha or 'unknown commit'}.")
+
+
+@app.cli.command('compare-extractors')
+@click.argument('paths', nargs=-1, required=True)
+def compare_extractors_command(paths):
+    """Checks that the fast and full table extractors agree on .sql files (files, directories or globs)."""
+    mismatches = fast = 0
+    file_paths = collect_sql_files(paths)
+    for file_path in file_paths:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            sql = f.read()
+        fast_result = _fast_extract(sql)
+        full_result = _extract_from_parsed(sqlparse.parse(sql))
+        if fast_result is None:
+            continue
+        fast += 1
+        if fast_result != full_result:
+            mismatches += 1
+            click.echo(f"MISMATCH {file_path}: fast={sorted(fast_result.tables)} full={sorted(full_result.tables)}")
+    click.echo(f"{len(file_paths)} file(s): {fast} on the fast path, {len(file_paths) - fast} fell back, {mismatches} mismatch(es).")
+    if mismatches:
+        raise SystemExit(1)
+
+
 # --- Main Execution ---
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0') # host='0.0.0.0' makes it accessible on network if needed
@@ -0,0 +1,353 @@
+"""
+Benchmarks for the load and translate hot paths.
+
+Generates a synthetic dbt project and SQL workload, serves the project from a local
+stand-in for the GitHub API (with injectable latency) and from a local directory, and
+times fetch, project build (reference map, provenance and resolution index), path index
+build and translation. Results are printed
+and can be written as JSON to compare between commits:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import app
+
+REPO_OWNER, REPO_NAME = 'bench', 'project'
+
+# --- Synthetic Data ---
+
+def generate_dbt_project(num_models=500, num_source_files=20, tables_per_source=10, columns_per_table=20, depth=3, seed=0):
+    """
+    Generates a synthetic dbt project as {file_path: content}: models spread over nested
+    folders under models/, source YAMLs with column definitions and tests, schema YAMLs
+    without sources, and a few files the loader should skip.
+    """
+    rng = random.Random(seed)
+    files = {'dbt_project.yml': f"name: {REPO_NAME}\nversion: '1.0'\n", 'README.md': '# Synthetic project\n'}
+    source_tables = []
+
+    for s in range(num_source_files):
+        lines = ['version: 2', 'sources:', f'  - name: src_{s}', f'    schema: raw_{s}', '    tables:']
+        for t in range(tables_per_source):
+            table_name = f'raw_{s}_{t}'
+            source_tables.append(table_name)
+            lines += [f'      - name: {table_name}', '        columns:']
+            for c in range(columns_per_table):
+                lines += [f'          - name: col_{c}', f'            description: "Column {c} of {table_name}"',
+                          '            tests:', '              - not_null']
+        files[f'models/sources/src_{s}.yml'] = '\n'.join(lines) + '\n'
+
+    model_names = []
+    for m in range(num_models):
+        folder = '/'.join(f'layer_{(m >> (2 * level)) % 4}' for level in range(rng.randint(0, depth)))
+        model_name = f'model_{m}'
+        upstream = rng.sample(model_names, min(len(model_names), 2)) + rng.sample(source_tables, min(len(source_tables), 1))
+        body = f"select * from {{{{ ref('{upstream[0]}') }}}}" if model_names else f"select * from {{{{ source('src_0', '{source_tables[0]}') }}}}"
+        files[f"models/{folder + '/' if folder else ''}{model_name}.sql"] = body + '\n'
+        model_names.append(model_name)
+        if m % 50 == 0:
+            files[f"models/{folder + '/' if folder else ''}schema_{m}.yml"] = f'version: 2\nmodels:\n  - name: {model_name}\n    columns:\n      - name: id\n'
+        if m % 100 == 0:
+            files[f'macros/macro_{m}.sql'] = '{% macro noop() %}{% endmacro %}\n'
+
+    return files, model_names, source_tables
+
+
+def generate_sql_workload(model_names, source_tables, num_queries=200, seed=0):
+    """
+    Generates (name, sql) queries over the project's models and sources: deep CTE chains,
+    many-way joins, huge IN-lists and simple selects, in equal parts.
+    """
+    rng = random.Random(seed)
+    names = model_names + source_tables
+    queries = []
+    for q in range(num_queries):
+        kind = q % 4
+        if kind == 0:
+            ctes = [f'cte_0 as (select * from {rng.choice(names)})']
+            for level in range(1, 30):
+                ctes.append(f'cte_{level} as (select c.*, t.col_1 from cte_{level - 1} c join {rng.choice(names)} t on c.id = t.id)')
+            sql = 'with ' + ',\n'.join(ctes) + '\nselect * from cte_29'
+        elif kind == 1:
+            tables = rng.sample(names, min(len(names), 25))
+            joins = '\n'.join(f'left join {table} t{i} on t0.id = t{i}.id' for i, table in enumerate(tables[1:], start=1))
+            sql = f'select t0.* from {tables[0]} t0\n{joins}\nwhere t0.status = \'active\''
+        elif kind == 2:
+            values = ', '.join(str(rng.randint(0, 10 ** 6)) for _ in range(5000))
+            sql = f'select * from {rng.choice(names)} where id in ({values})'
+        else:
+            sql = f'select a.id, b.name from {rng.choice(names)} a join {rng.choice(names)} b on a.id = b.id -- lookup'
+        queries.append((f'{["cte_chain", "many_joins", "in_list", "simple"][kind]}_{q}', sql))
+    return queries
+
+# --- GitHub API Stand-in ---
+
+class FakeGitHubServer:
+    """
+    Serves a {file_path: content} project over HTTP in the shape of the GitHub contents,
+    git trees, tarball and raw download endpoints, sleeping `latency` seconds per request.
+    """
+
+    def __init__(self, files, latency=0.0):
+        self.files = files
+        self.latency = latency
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._dirs = {}
+        for file_path in files:
+            parts = file_path.split('/')
+            for i in range(len(parts)):
+                parent = '/'.join(parts[:i])
+                child = '/'.join(parts[:i + 1])
+                self._dirs.setdefault(parent, set()).add((child, 'file' if i == len(parts) - 1 else 'dir'))
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    @property
+    def contents_api_url(self):
+        return f'{self.base_url}/repos/{REPO_OWNER}/{REPO_NAME}/contents/'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _sha(self, file_path):
+        return hashlib.sha1(self.files[file_path].encode('utf-8')).hexdigest()
+
+    def _make_handler(self):
+        server = self
+        api_prefix = f'/repos/{REPO_OWNER}/{REPO_NAME}/'
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True # Headers and body go out in separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type='application/json'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with server._lock:
+                    server.request_count += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                path = self.path.split('?', 1)[0]
+                if path.startswith(api_prefix + 'contents/'):
+                    return self._contents(path[len(api_prefix + 'contents/'):].strip('/'))
+                if path.startswith(api_prefix + 'git/trees/'):
+                    tree = [{'path': p, 'type': 'blob', 'sha': server._sha(p), 'url': f'{server.base_url}/raw/{p}'} for p in sorted(server.files)]
+                    return self._send(200, json.dumps({'sha': 'bench', 'tree': tree, 'truncated': False}).encode())
+                if path.startswith(api_prefix + 'tarball'):
+                    return self._send(200, server.tarball(), 'application/x-gzip')
+                if path == api_prefix + 'commits/HEAD':
+                    return self._send(404, b'{}')
+                if path.startswith('/raw/'):
+                    file_path = path[len('/raw/'):]
+                    if file_path in server.files:
+                        return self._send(200, server.files[file_path].encode('utf-8'), 'text/plain')
+                self._send(404, b'{}')
+
+            def _contents(self, dir_path):
+                if dir_path not in server._dirs:
+                    return self._send(404, b'{"message": "Not Found"}')
+                items = []
+                for child, item_type in sorted(server._dirs[dir_path]):
+                    item = {'path': child, 'type': item_type, 'url': f'{server.base_url}{api_prefix}contents/{child}'}
+                    if item_type == 'file':
+                        item.update({'sha': server._sha(child), 'download_url': f'{server.base_url}/raw/{child}'})
+                    items.append(item)
+                self._send(200, json.dumps(items).encode())
+
+        return Handler
+
+    def tarball(self):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            for file_path, content in sorted(self.files.items()):
+                data = content.encode('utf-8')
+                info = tarfile.TarInfo(f'{REPO_OWNER}-{REPO_NAME}-bench/{file_path}')
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+# --- Measurement ---
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(operation, items, repeat, unit):
+    """
+    Runs operation(item) for every item, `repeat` times, timing each call. A separate traced
+    pass measures peak memory so tracing overhead doesn't skew the timings.
+    """
+    durations = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            call_started = time.perf_counter()
+            operation(item)
+            durations.append(time.perf_counter() - call_started)
+    total = time.perf_counter() - started
+
+    tracemalloc.start()
+    for item in items:
+        operation(item)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'calls': len(durations),
+        'unit': unit,
+        'total_s': total,
+        'throughput_per_s': len(durations) / total if total else 0.0,
+        'p50_ms': percentile(durations, 0.50) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+        'peak_mem_mb': peak_bytes / (1024 * 1024),
+    }
+
+
+def run_benchmarks(args):
+    files, model_names, source_tables = generate_dbt_project(args.models, args.source_files, args.tables_per_source, seed=args.seed)
+    relevant_files = {p: c for p, c in files.items() if app.is_relevant_dbt_file(p)}
+    workload = generate_sql_workload(model_names, source_tables, args.queries, seed=args.seed)
+    results = {}
+
+    with FakeGitHubServer(files, latency=args.latency) as server:
+        for mode in args.ingest_modes:
+            fetched = {}
+            def fetch(_):
+                fetched['files'] = app.fetch_dbt_project_files(server.contents_api_url, mode)
+            results[f'fetch_{mode}'] = measure(fetch, [None], args.fetch_repeat, 'project')
+            if fetched['files'] != relevant_files:
+                raise SystemExit(f'fetch_{mode} returned {len(fetched["files"] or {})} files, expected {len(relevant_files)}')
+
+    with tempfile.TemporaryDirectory() as project_dir:
+        for file_path, content in files.items():
+            full_path = os.path.join(project_dir, file_path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+        fetched = {}
+        def read_local(_):
+            fetched['files'] = app.read_local_project_files(project_dir)
+        results['fetch_local'] = measure(read_local, [None], args.fetch_repeat, 'project')
+        if fetched['files'] != relevant_files:
+            raise SystemExit(f'fetch_local returned {len(fetched["files"])} files, expected {len(relevant_files)}')
+
+    # The same build /load_model runs: reference map with provenance, then the resolution index
+    build = lambda files: app.build_project(app.get_github_api_url(f'https://github.com/{REPO_OWNER}/{REPO_NAME}'), None, files)
+    results['build_project'] = measure(build, [relevant_files], args.repeat, 'project')
+    results['create_path_index'] = measure(app.create_path_index, [relevant_files], args.repeat, 'project')
+
+    project = build(relevant_files)
+    reference_map, resolution_index = project['reference_map'], project['resolution_index']
+    translate = lambda sql: app.perform_translation(reference_map, sql, resolution_index)
+    sql_queries = [sql for _, sql in workload]
+    cached_parse_cache = app.parse_cache
+    app.parse_cache = app.LRUCache(0) # Every translation parses from scratch
+    try:
+        results['translate'] = measure(translate, sql_queries, args.repeat, 'query')
+    finally:
+        app.parse_cache = cached_parse_cache
+    for sql in sql_queries: # Warm the parse cache so translate_cached times hits only
+        translate(sql)
+    results['translate_cached'] = measure(translate, sql_queries, args.repeat, 'query')
+    return results
+
+
+def describe_run(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+    }
+
+
+def print_results(results, baseline=None):
+    header = f"{'stage':<22}{'calls':>7}{'per sec':>12}{'p50 ms':>11}{'p99 ms':>11}{'peak MB':>10}"
+    if baseline:
+        header += f"{'p50 vs base':>13}"
+    print(header)
+    for stage, stats in results.items():
+        line = (f"{stage:<22}{stats['calls']:>7}{stats['throughput_per_s']:>12.1f}{stats['p50_ms']:>11.2f}"
+                f"{stats['p99_ms']:>11.2f}{stats['peak_mem_mb']:>10.1f}")
+        base = (baseline or {}).get(stage)
+        if base and base.get('p50_ms'):
+            line += f"{stats['p50_ms'] / base['p50_ms']:>12.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', type=int, default=500, help='Number of synthetic models.')
+    parser.add_argument('--source-files', type=int, default=20, help='Number of source YAML files.')
+    parser.add_argument('--tables-per-source', type=int, default=10, help='Tables declared per source YAML file.')
+    parser.add_argument('--queries', type=int, default=200, help='Number of SQL queries in the translation workload.')
+    parser.add_argument('--latency', type=float, default=0.005, help='Seconds of latency added to every stand-in API request.')
+    parser.add_argument('--ingest-modes', nargs='*', default=list(app.INGEST_MODES), choices=app.INGEST_MODES, help='Fetch modes to benchmark.')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions of the build, path index and translate stages.')
+    parser.add_argument('--fetch-repeat', type=int, default=3, help='Repetitions of each fetch stage.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic project and workload.')
+    parser.add_argument('--output', help='Write machine-readable results to this JSON file.')
+    parser.add_argument('--compare', help='Earlier results JSON to compare p50 latencies against.')
+    args = parser.parse_args()
+    app.logger.setLevel(logging.WARNING) # Keep per-stage progress logging out of the timings
+
+    results = run_benchmarks(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results')
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'run': describe_run(args), 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+select * from `project.dataset.orders`
@@ -0,0 +1,3 @@
+-- orders; not a statement end
+select * /* from fake */ from orders -- join nope
+join customers on true
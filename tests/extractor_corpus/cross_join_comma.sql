@@ -0,0 +1 @@
+select * from orders, customers, payments p where p.order_id = orders.id
@@ -0,0 +1,4 @@
+with recent as (
+    select * from orders where created_at > current_date - 7
+)
+select * from recent join customers on customers.id = recent.customer_id
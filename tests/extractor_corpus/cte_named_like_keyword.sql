@@ -0,0 +1,2 @@
+with source as (select * from raw_orders)
+select * from source
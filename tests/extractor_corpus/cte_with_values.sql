@@ -0,0 +1 @@
+with v (id) as (values (1), (2)) select * from v join orders on orders.id = v.id
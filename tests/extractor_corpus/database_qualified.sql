@@ -0,0 +1 @@
+select * from warehouse.analytics.orders
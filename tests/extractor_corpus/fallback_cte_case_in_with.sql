@@ -0,0 +1 @@
+with x as (select 1) case when 1 then select * from orders end
@@ -0,0 +1 @@
+select * from orders)
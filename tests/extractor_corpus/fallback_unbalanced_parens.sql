@@ -0,0 +1 @@
+select * from (select * from orders
@@ -0,0 +1 @@
+select * from (with a as (select * from orders) select * from a) s
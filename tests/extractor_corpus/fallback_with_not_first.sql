@@ -0,0 +1 @@
+insert into t with a as (select * from orders) select * from a
@@ -0,0 +1 @@
+select * from customers where id in (select customer_id from orders)
@@ -0,0 +1 @@
+insert into order_archive select * from orders where created_at < '2020-01-01'
@@ -0,0 +1 @@
+select * from {{ ref('orders') }} join customers on true
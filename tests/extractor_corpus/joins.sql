@@ -0,0 +1,4 @@
+select o.id, c.name
+from orders o
+left join customers c on c.id = o.customer_id
+inner join payments as p on p.order_id = o.id
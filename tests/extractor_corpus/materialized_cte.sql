@@ -0,0 +1,2 @@
+with totals as materialized (select customer_id, sum(amount) as total from payments group by 1)
+select * from customers join totals using (customer_id)
@@ -0,0 +1,3 @@
+select * from orders;
+select * from customers;
+delete from stale_rows where id in (select id from old_rows);
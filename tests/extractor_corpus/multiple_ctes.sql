@@ -0,0 +1,2 @@
+with a as (select * from stg_orders), b as (select * from stg_payments)
+select * from a join b using (order_id)
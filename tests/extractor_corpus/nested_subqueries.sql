@@ -0,0 +1 @@
+select * from (select * from (select id from orders) inner_q) outer_q
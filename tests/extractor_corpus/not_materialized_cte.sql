@@ -0,0 +1,2 @@
+with totals as not materialized (select * from payments)
+select * from totals
@@ -0,0 +1 @@
+select * from "Orders" join "raw"."Customers" c on c.id = "Orders".customer_id
@@ -0,0 +1,6 @@
+with recursive tree as (
+    select id, parent_id from categories where parent_id is null
+    union all
+    select c.id, c.parent_id from categories c join tree t on c.parent_id = t.id
+)
+select * from tree
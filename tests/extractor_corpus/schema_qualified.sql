@@ -0,0 +1 @@
+select * from analytics.orders join raw.customers on raw.customers.id = analytics.orders.customer_id
@@ -0,0 +1 @@
+select id, name from customers where status = 'active'
@@ -0,0 +1 @@
+select 'from fake_table' as note, * from orders where note != 'join x'
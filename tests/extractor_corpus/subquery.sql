@@ -0,0 +1 @@
+select * from (select * from orders where amount > 10) big_orders join customers on customers.id = big_orders.customer_id
@@ -0,0 +1 @@
+select id from orders union all select id from returns
@@ -0,0 +1 @@
+update orders set status = 'closed' from customers where customers.id = orders.customer_id
@@ -0,0 +1 @@
+select id, row_number() over (partition by customer_id order by created_at) from orders
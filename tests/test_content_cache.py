@@ -0,0 +1,109 @@
+import hashlib
+import json
+
+import app
+
+
+REPO_API_URL = 'https://api.github.com/repos/o/r/contents/'
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b'', etag=None):
+        self.status_code = status_code
+        self.content = body
+        self.headers = {'ETag': etag} if etag else {}
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise app.requests.exceptions.HTTPError(response=self)
+
+
+class FakeGitHub:
+    """Serves the contents API for a dict of commit sha -> {path: content}; records every GET."""
+
+    def __init__(self, commits):
+        self.commits = commits
+        self.requests = []
+
+    def _tree_sha(self, files, directory):
+        prefix = f"{directory}/" if directory else ''
+        listed = sorted((path, content) for path, content in files.items() if path.startswith(prefix))
+        return hashlib.sha1(repr(listed).encode('utf-8')).hexdigest()
+
+    def _listing(self, files, directory, ref):
+        prefix = f"{directory}/" if directory else ''
+        children = {}
+        for path, content in files.items():
+            if not path.startswith(prefix): continue
+            name, _, rest = path[len(prefix):].partition('/')
+            child_path = prefix + name
+            if rest:
+                children[child_path] = {'path': child_path, 'type': 'dir', 'sha': self._tree_sha(files, child_path)}
+            else:
+                children[child_path] = {'path': child_path, 'type': 'file', 'sha': hashlib.sha1(content.encode('utf-8')).hexdigest(),
+                                        'download_url': f"https://raw.example/{ref}/{child_path}"}
+        return [children[path] for path in sorted(children)]
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append(url)
+        if url.startswith('https://raw.example/'):
+            ref, _, path = url[len('https://raw.example/'):].partition('/')
+            return FakeResponse(200, self.commits[ref][path].encode('utf-8'))
+        path, _, query = url[len(REPO_API_URL):].partition('?ref=')
+        body = json.dumps(self._listing(self.commits[query], path, query)).encode('utf-8')
+        return FakeResponse(200, body, etag='"' + hashlib.md5(body).hexdigest() + '"')
+
+
+def fetch(cache, github, ref):
+    files_content = app.fetch_github_repo_files(REPO_API_URL, max_workers=2, http_session=github, cache=cache, ref=ref)
+    cache.save()
+    return files_content
+
+
+def listing_requests(github):
+    return sorted(url for url in github.requests if url.startswith(REPO_API_URL))
+
+
+FIRST = {
+    'dbt_project.yml': 'name: p\n',
+    'models/staging/stg_orders.sql': 'select 1',
+    'models/marts/orders.sql': "select * from {{ ref('stg_orders') }}",
+}
+SECOND = dict(FIRST, **{'models/marts/customers.sql': 'select 2'})
+
+
+def test_unchanged_subtrees_are_not_listed_again_at_a_new_commit(tmp_path):
+    github = FakeGitHub({'c1': FIRST, 'c2': SECOND})
+    assert fetch(app.ContentCache(str(tmp_path), REPO_API_URL), github, 'c1') == FIRST
+
+    github.requests.clear()
+    cache = app.ContentCache(str(tmp_path), REPO_API_URL)
+    assert fetch(cache, github, 'c2') == SECOND
+    # The root and every directory on the path to the change are listed; models/staging is not
+    assert listing_requests(github) == [REPO_API_URL + '?ref=c2', REPO_API_URL + 'models/marts?ref=c2', REPO_API_URL + 'models?ref=c2']
+    assert [url for url in github.requests if not url.startswith(REPO_API_URL)] == ['https://raw.example/c2/models/marts/customers.sql']
+    assert cache.stats['listing_hits'] == 1
+
+
+def test_pinned_listings_are_not_kept_by_url(tmp_path):
+    cache = app.ContentCache(str(tmp_path), REPO_API_URL)
+    fetch(cache, FakeGitHub({'c1': FIRST}), 'c1')
+    assert not any(key.startswith('url:') for key in cache._listings)
+    assert len(cache._listings) == 3
+
+
+def test_manifest_keeps_the_most_recently_used_listings(tmp_path):
+    cache = app.ContentCache(str(tmp_path), REPO_API_URL, max_listings=2)
+    for index in range(5):
+        cache.put_tree_listing(f'sha{index}', 'models', [])
+    cache.get_tree_listing('sha3', 'models')
+    cache.put_tree_listing('sha5', 'models', [])
+    cache.save()
+
+    reloaded = app.ContentCache(str(tmp_path), REPO_API_URL, max_listings=2)
+    assert reloaded.get_tree_listing('sha3', 'models') == []
+    assert reloaded.get_tree_listing('sha5', 'models') == []
+    assert reloaded.get_tree_listing('sha4', 'models') is None
@@ -0,0 +1,34 @@
+import glob
+import os
+
+import pytest
+import sqlparse
+
+from app import _extract_from_parsed, _fast_extract
+
+
+# dbt-style queries; files named fallback_*.sql must take the full parse, all others the fast path
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extractor_corpus')
+CORPUS = sorted(glob.glob(os.path.join(CORPUS_DIR, '*.sql')))
+
+
+def read_query(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('path', CORPUS, ids=os.path.basename)
+def test_fast_extractor_matches_full_parse(path):
+    sql = read_query(path)
+    fast = _fast_extract(sql)
+    if os.path.basename(path).startswith('fallback_'):
+        assert fast is None
+    else:
+        assert fast is not None
+        assert fast == _extract_from_parsed(sqlparse.parse(sql))
+
+
+def test_corpus_covers_both_paths():
+    names = [os.path.basename(path) for path in CORPUS]
+    assert any(name.startswith('fallback_') for name in names)
+    assert any(not name.startswith('fallback_') for name in names)
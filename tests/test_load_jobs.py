@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def shared_store(tmp_path, monkeypatch):
+    store = app.SQLiteProjectStore(str(tmp_path / 'projects.sqlite3'))
+    monkeypatch.setattr(app, 'project_store', store)
+    return store
+
+
+@pytest.fixture
+def blocked_load(monkeypatch):
+    """Makes load jobs report one file and then wait for the returned event before finishing."""
+    release = threading.Event()
+
+    def run_project_load(job):
+        job.set_stage('fetch')
+        job.file_fetched('models/orders.sql', 8)
+        job.publish()
+        release.wait(30)
+        project = app.build_project(job.repo_url, job.commit_sha, {'models/orders.sql': 'select 1'})
+        project_id = app.make_project_id(job.repo_url, job.commit_sha)
+        app.project_store.put(project_id, project)
+        job.finish(project_id, project, app.load_result(project))
+
+    monkeypatch.setattr(app, 'run_project_load', run_project_load)
+    yield release
+    release.set()
+
+
+def new_job(commit_sha='c1'):
+    repo_url = 'https://api.github.com/repos/o/r/contents/'
+    return app.LoadJob(app.make_project_id(repo_url, commit_sha), repo_url, commit_sha)
+
+
+def test_a_load_running_in_another_worker_is_joined_and_followed(shared_store, blocked_load):
+    first_worker, second_worker = app.LoadJobQueue(1, 60), app.LoadJobQueue(1, 60)
+    job, joined = first_worker.submit(new_job())
+    assert not joined
+
+    other, joined = second_worker.submit(new_job())
+    assert joined and isinstance(other, app.StoredLoadJob) and other.id == job.id
+    _, snapshot = other.wait_for_change(-1, timeout=5)
+    assert snapshot['state'] in ('queued', 'running')
+    assert second_worker.get(job.id).snapshot()['job_id'] == job.id
+
+    blocked_load.set()
+    assert other.wait(timeout=10)
+    assert other.state == 'done'
+    assert other.project_id == app.make_project_id(job.repo_url, 'c1')
+    assert other.result['message'] == 'Successfully loaded 1 models/sources.'
+
+
+def test_a_job_whose_worker_stopped_publishing_is_failed_and_replaced(shared_store, blocked_load, monkeypatch):
+    job, _ = app.LoadJobQueue(1, 60).submit(new_job())
+    monkeypatch.setattr(app, 'LOAD_JOB_STALE_AFTER', -1)
+
+    stale = app.LoadJobQueue(1, 60).get(job.id)
+    assert stale.state == 'failed' and stale.status_code == 500
+
+    replacement, joined = app.LoadJobQueue(1, 60).submit(new_job())
+    assert not joined and replacement.id != job.id
@@ -0,0 +1,42 @@
+import threading
+
+import app
+
+
+def run_while_metrics_are_busy(operation, timeout=120):
+    """Runs operation() on a thread while four others keep taking the metrics lock; returns its result."""
+    stop = threading.Event()
+
+    def record_metrics():
+        while not stop.is_set():
+            app.metrics.inc('http_requests_total', kind='test', status='200')
+
+    busy = [threading.Thread(target=record_metrics, daemon=True) for _ in range(4)]
+    outcome = []
+    worker = threading.Thread(target=lambda: outcome.append(operation()), daemon=True)
+    for thread in busy:
+        thread.start()
+    try:
+        worker.start()
+        worker.join(timeout)
+    finally:
+        stop.set()
+    assert not worker.is_alive(), 'process pool hung'
+    return outcome[0]
+
+
+def test_batch_translation_while_other_threads_use_metrics():
+    project = app.build_project('repo', None, {'models/orders.sql': 'select 1'})
+    items = [(str(index), 'select * from orders', None) for index in range(16)]
+    results = run_while_metrics_are_busy(
+        lambda: list(app.translate_batch(project['reference_map'], items, 4, project['resolution_index'])))
+    assert sorted(result['index'] for result in results) == list(range(16))
+    assert all(result['translated_sql'] == "select * from {{ ref('orders') }}" for result in results)
+
+
+def test_parallel_yaml_parsing_while_other_threads_use_metrics(monkeypatch):
+    monkeypatch.setattr(app, 'YAML_PARALLEL_MIN_BYTES', 0)
+    yaml_contents = [(f'models/sources_{index}.yml', f'sources:\n  - name: src_{index}\n    tables:\n      - name: table_{index}\n')
+                     for index in range(8)]
+    results = run_while_metrics_are_busy(lambda: app.parse_yaml_sources(yaml_contents, max_workers=4))
+    assert [[source_table.table_name for source_table in tables] for tables in results] == [[f'table_{index}'] for index in range(8)]
@@ -0,0 +1,46 @@
+import json
+import sqlite3
+
+import app
+
+
+def project(repo_url, commit_sha):
+    return app.build_project(repo_url, commit_sha, {'models/orders.sql': 'select 1'})
+
+
+def stored_ids(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {row[0] for row in conn.execute('SELECT project_id FROM projects')}
+    finally:
+        conn.close()
+
+
+def test_keeps_the_most_recent_projects_per_repository_and_the_latest(tmp_path):
+    db_path = str(tmp_path / 'projects.sqlite3')
+    store = app.SQLiteProjectStore(db_path, max_per_repo=2)
+    store.put('a1', project('repo-a', 'c1'))
+    # An older commit loaded from an index doesn't displace a1 as the latest...
+    for commit in ('c2', 'c3', 'c4'):
+        store.put(f'a-{commit}', project('repo-a', commit), replace_latest=False)
+    store.put('b1', project('repo-b', 'c1'))
+
+    # ...so a1 survives eviction alongside the two most recently stored
+    assert stored_ids(db_path) == {'a1', 'a-c3', 'a-c4', 'b1'}
+    assert store.latest('repo-a')['commit_sha'] == 'c1'
+
+
+def test_rows_stored_before_eviction_get_their_repository(tmp_path):
+    db_path = str(tmp_path / 'projects.sqlite3')
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute('CREATE TABLE projects (project_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)')
+        for index in range(3):
+            conn.execute('INSERT INTO projects VALUES (?, ?, ?)',
+                         (f'old{index}', json.dumps(app.project_to_json(project('repo-a', f'old{index}'))), index))
+    conn.close()
+
+    store = app.SQLiteProjectStore(db_path, max_per_repo=2)
+    assert store.get('old0')['commit_sha'] == 'old0'
+    store.put('new', project('repo-a', 'new'))
+    assert stored_ids(db_path) == {'old2', 'new'}
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+import app
+
+
+NAMES = ['orders', 'customers', 'payments', 'visits', 'stg_orders']
+SQL_DIRS = ['models', 'models/staging', 'models/marts', 'analyses']
+YAML_PATHS = ['models/sources.yml', 'models/staging/sources.yml', 'models/marts/schema.yml', 'dbt_project.yml']
+
+
+def random_yaml(rng):
+    if rng.random() < 0.2:
+        return 'version: 2\nmodels:\n  - name: orders\n'
+    lines = ['version: 2', 'sources:']
+    for source_name in rng.sample(['raw', 'app', 'legacy'], rng.randint(1, 2)):
+        lines += [f'  - name: {source_name}', '    tables:']
+        lines += [f'      - name: {name}' for name in rng.sample(NAMES, rng.randint(1, 3))]
+    return '\n'.join(lines) + '\n'
+
+
+def random_change(rng, files_content):
+    """Returns (file_path, new content or None for a deletion)."""
+    if files_content and rng.random() < 0.35:
+        return rng.choice(list(files_content)), None
+    if rng.random() < 0.5:
+        return rng.choice(YAML_PATHS), random_yaml(rng)
+    return f"{rng.choice(SQL_DIRS)}/{rng.choice(NAMES)}.sql", f'select {rng.randint(0, 9)}'
+
+
+def full_build(files_content):
+    provenance = app.new_reference_provenance()
+    reference_map = app.build_reference_map(files_content, provenance)
+    return reference_map, provenance
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_updates_match_a_full_rebuild(seed):
+    rng = random.Random(seed)
+    files_content = dict(random_change(rng, {}) for _ in range(rng.randint(0, 8)))
+    reference_map, provenance = full_build(files_content)
+
+    for _ in range(6):
+        changed_files = dict(random_change(rng, files_content) for _ in range(rng.randint(1, 4)))
+        for file_path, content in changed_files.items():
+            # A full rebuild sees modified files where they were and new ones last, as the update does
+            if content is None:
+                files_content.pop(file_path, None)
+            else:
+                files_content[file_path] = content
+        reference_map, provenance = app.update_reference_map(reference_map, provenance, changed_files)
+
+        expected_map, expected_provenance = full_build(files_content)
+        assert reference_map == expected_map
+        assert (app.build_resolution_index(reference_map, provenance)
+                == app.build_resolution_index(expected_map, expected_provenance))
+
+
+def test_a_deleted_model_falls_back_to_the_source_of_the_same_name():
+    files_content = {
+        'models/orders.sql': 'select 1',
+        'models/sources.yml': 'sources:\n  - name: raw\n    tables:\n      - name: orders\n',
+    }
+    reference_map, provenance = full_build(files_content)
+    assert reference_map['orders'] == ('model', 'orders', None, 'models/orders.sql')
+
+    reference_map, provenance = app.update_reference_map(reference_map, provenance, {'models/orders.sql': None})
+    assert reference_map['orders'] == ('source', 'raw', 'orders', 'models/sources.yml')
+
+    reference_map, _ = app.update_reference_map(reference_map, provenance, {'models/sources.yml': None})
+    assert reference_map == {}
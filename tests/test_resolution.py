@@ -0,0 +1,74 @@
+import pytest
+
+import app
+
+
+FILES = {
+    'models/orders.sql': 'select 1',
+    'models/customers.sql': 'select 1',
+    'models/raw.yml': 'sources:\n  - name: raw\n    tables:\n      - name: orders\n      - name: payments\n      - name: visits\n',
+    'models/app.yml': ('sources:\n  - name: app\n    schema: app_prod\n    database: warehouse\n    tables:\n'
+                       '      - name: visits\n        identifier: app_visits\n'),
+}
+
+
+@pytest.fixture(scope='module')
+def project():
+    return app.build_project('repo', None, FILES)
+
+
+def translate(project, sql):
+    return app._perform_translation(project['reference_map'], sql, project['resolution_index'])
+
+
+def test_a_bare_name_declared_by_two_sources_is_ambiguous(project):
+    assert app.resolve_table_name(project['resolution_index'], ('visits',)) == (
+        ('source', 'raw', 'visits', 'models/raw.yml'), ('source', 'app', 'visits', 'models/app.yml'))
+    sql, error, unresolved = translate(project, 'select * from visits')
+    assert sql == 'select * from visits'
+    assert error == ("Error: The following table names are ambiguous; qualify them with a schema or source name: "
+                     "visits could be {{ source('raw', 'visits') }} or {{ source('app', 'visits') }}")
+    assert unresolved == {'visits'}
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ('select * from raw.orders', "select * from {{ source('raw', 'orders') }}"),
+    ('select * from raw.visits', "select * from {{ source('raw', 'visits') }}"),
+    ('select * from app.visits', "select * from {{ source('app', 'visits') }}"),
+    ('select * from app_visits', "select * from {{ source('app', 'visits') }}"),
+    ('select * from app_prod.app_visits', "select * from {{ source('app', 'visits') }}"),
+    ('select * from warehouse.app_prod.app_visits', "select * from {{ source('app', 'visits') }}"),
+])
+def test_qualified_names_and_identifiers_resolve_to_their_source(project, sql, expected):
+    assert translate(project, sql) == (expected, None, set())
+
+
+def test_a_bare_name_shared_by_a_model_and_a_source_is_the_model(project):
+    assert translate(project, 'select * from orders') == ("select * from {{ ref('orders') }}", None, set())
+
+
+def test_an_unknown_qualified_name_falls_back_to_a_model(project):
+    assert translate(project, 'select * from analytics.customers') == ("select * from {{ ref('customers') }}", None, set())
+
+
+def test_an_unknown_qualified_name_does_not_fall_back_to_a_source(project):
+    sql, error, unresolved = translate(project, 'select * from other.payments')
+    assert (sql, unresolved) == ('select * from other.payments', {'other.payments'})
+    assert error == 'Error: The following tables were not found in the loaded dbt project: other.payments'
+
+
+# Outputs of the original per-table re.subn rewrite, which the single-pass rewriter must reproduce byte for byte
+@pytest.mark.parametrize('sql, expected', [
+    ('select orders.id, o.amount from orders o join customers c on o.cid = c.id',
+     "select {{ ref('orders') }}.id, o.amount from {{ ref('orders') }} o join {{ ref('customers') }} c on o.cid = c.id"),
+    ('select orders.id from orders', "select {{ ref('orders') }}.id from {{ ref('orders') }}"),
+    ('select * from `orders`', "select * from `{{ ref('orders') }}`"),
+    ('select * from "orders"', 'select * from "orders"'),
+    ('select * from orders as ord join payments on payments.oid = ord.id',
+     "select * from {{ ref('orders') }} as ord join {{ source('raw', 'payments') }} on {{ source('raw', 'payments') }}.oid = ord.id"),
+    ("select * from customers -- orders\nwhere x = 'orders'", "select * from {{ ref('customers') }} -- orders\nwhere x = 'orders'"),
+    ('with orders_cte as (select * from orders) select * from orders_cte',
+     "with orders_cte as (select * from {{ ref('orders') }}) select * from orders_cte"),
+])
+def test_rewrite_output_is_unchanged(project, sql, expected):
+    assert app.perform_translation(project['reference_map'], sql, project['resolution_index']) == (expected, None)
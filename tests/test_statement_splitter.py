@@ -0,0 +1,47 @@
+import pytest
+import sqlparse
+
+from app import SqlStatementSplitter
+
+
+SCRIPTS = [
+    "select * from t1; select * from t2;",
+    "select 'a;b' from t1; select \"c;d\" from t2",
+    "select 1 -- trailing; comment\n; /* block; comment */ select 2;",
+    "create function f() returns int as $$ select 'x' from don't $$ language sql; select * from t1; select 2;",
+    "create function g() returns text as $body$ select 1; select '$$'; $body$ language sql; select * from t1;",
+    "select $a$ $b$ ; $a$; select 1;",
+    "select $$$$; select 2;",
+    "select a$$b; select 1;",
+    "select $1, $2 from t1; select 3;",
+]
+
+
+def split_in_chunks(script, chunk_size):
+    splitter = SqlStatementSplitter()
+    statements = []
+    for start in range(0, len(script), chunk_size):
+        statements.extend(splitter.feed(script[start:start + chunk_size]))
+    statements.append(splitter.close())
+    return statements
+
+
+@pytest.mark.parametrize('script', SCRIPTS)
+def test_splits_like_sqlparse(script):
+    statements = split_in_chunks(script, len(script))
+    assert ''.join(statements) == script
+    assert [statement.strip() for statement in statements if statement.strip()] == sqlparse.split(script)
+
+
+@pytest.mark.parametrize('script', SCRIPTS)
+def test_chunk_boundaries_do_not_change_the_split(script):
+    expected = split_in_chunks(script, len(script))
+    for chunk_size in range(1, len(script)):
+        assert split_in_chunks(script, chunk_size) == expected, chunk_size
+
+
+def test_dollar_quoted_body_does_not_hold_back_later_statements():
+    splitter = SqlStatementSplitter()
+    completed = splitter.feed("create function f() returns int as $$ select 'x' from don't $$ language sql; select * from t1;")
+    assert len(completed) == 2
+    assert completed[1] == " select * from t1;"
@@ -0,0 +1,30 @@
+import pytest
+
+import app
+
+
+TABLE_T = [app.SourceTable('s', 't', None, 's', 't')]
+
+CASES = [
+    ('block', 'version: 2\nsources:\n  - name: s\n    tables:\n      - name: t\n', TABLE_T),
+    ('block_with_bom', '\ufeffsources:\n  - name: s\n    tables:\n      - name: t\n', TABLE_T),
+    ('flow', '{sources: [{name: s, tables: [{name: t}]}]}', TABLE_T),
+    ('flow_with_bom', '\ufeff{sources: [{name: s, tables: [{name: t}]}]}', TABLE_T),
+    ('flow_after_other_keys', '{version: 2, sources: [{name: s, tables: [{name: t}]}]}', TABLE_T),
+    ('json', '{"sources": [{"name": "s", "tables": [{"name": "t"}]}]}', TABLE_T),
+    ('quoted_key', "'sources':\n  - name: s\n    tables:\n      - name: t\n", TABLE_T),
+    ('models_only', 'version: 2\nmodels:\n  - name: orders\n    description: "sources: none"\n', []),
+]
+
+
+@pytest.mark.parametrize('name, content, expected', CASES, ids=[case[0] for case in CASES])
+def test_parse_yaml_sources(name, content, expected):
+    assert app.parse_yaml_sources([(f'models/{name}.yml', content)]) == [expected]
+
+
+@pytest.mark.parametrize('name, content, expected', CASES, ids=[case[0] for case in CASES])
+def test_prescan_never_skips_a_file_with_sources(name, content, expected):
+    tables = app._load_yaml_source_tables(f'models/{name}.yml', content)[0]
+    assert tables == expected
+    if tables:
+        assert app.YAML_SOURCES_KEY.search(content)